@@ -1,8 +1,9 @@
 from compgraph import ComputeGraph
+from compgraph.src import aggregations
+from compgraph.src.batch import np
 
 from math import log
 from collections import defaultdict
-import heapq
 import datetime
 from math import cos, sin, radians, atan2, sqrt
 
@@ -22,12 +23,14 @@ def word_count_reduce(key, rows):
     yield res
 
 
-def build_word_count_graph(input_stream):
+def build_word_count_graph(input_stream, workers=None, top=None):
     graph = ComputeGraph(source=input_stream)
-    graph.add_map(split_word_map)
-    graph.add_sort(sort_by="text")
-    graph.add_reduce(word_count_reduce, reduce_by="text")
-    graph.add_sort(sort_by=("count", "text"))
+    graph.add_map(split_word_map, workers=workers, in_place=True)
+    graph.add_aggregate("text", {"count": aggregations.count()})
+    if top is None:
+        graph.add_sort(sort_by=("count", "text"))
+    else:
+        graph.add_top_k(top, by="count", reverse=True)
     return graph
 
 
@@ -60,40 +63,31 @@ def tf_counter(key, rows):
         }
 
 
-def invert_index(key, rows):
-    rows = heapq.nlargest(3, rows, key=lambda row: row["tf"] * row["idf"])
-    for row in rows:
-        row["tf_idf"] = row["tf"] * row["idf"]
-        del row["tf"]
-        del row["idf"]
-    for row in sorted(rows, key=lambda r: r["tf_idf"], reverse=True):
-        yield row
+def tf_idf_mapper(row):
+    row["tf_idf"] = row.pop("tf") * row.pop("idf")
+    yield row
 
 
-def build_inverted_index_graph(input_stream):
+def build_inverted_index_graph(input_stream, workers=None):
     split_word_graph = ComputeGraph(source=input_stream)
-    split_word_graph.add_map(split_word_map)
+    split_word_graph.add_map(split_word_map, workers=workers, in_place=True)
 
     count_docs_graph = ComputeGraph(source=input_stream)
     count_docs_graph.add_fold(count_docs_fold)
 
     idf_graph = ComputeGraph(source=split_word_graph)
-    idf_graph.add_sort(sort_by=("doc_id", "text"))
-    idf_graph.add_reduce(word_count_reduce, reduce_by=("doc_id", "text"))
+    idf_graph.add_reduce(word_count_reduce, reduce_by=("doc_id", "text"), workers=workers, presorted=False)
 
     idf_graph.add_join(on=count_docs_graph, strategy="inner")
-    idf_graph.add_sort(sort_by="text")
-    idf_graph.add_reduce(idf_counter, reduce_by="text")
+    idf_graph.add_reduce(idf_counter, reduce_by="text", workers=workers, presorted=False)
 
     calc_index = ComputeGraph(source=split_word_graph)
-    calc_index.add_sort(sort_by="doc_id")
-    calc_index.add_reduce(tf_counter, reduce_by="doc_id")
+    calc_index.add_reduce(tf_counter, reduce_by="doc_id", workers=workers, presorted=False)
 
     calc_index.add_sort(sort_by="text")
     calc_index.add_join(on=idf_graph, join_by="text", strategy="inner")
-    calc_index.add_sort("text")
-    calc_index.add_reduce(invert_index, reduce_by="text")
-    calc_index.add_sort("text")
+    calc_index.add_map(tf_idf_mapper, in_place=True)
+    calc_index.add_top_k(3, by="tf_idf", per="text", reverse=True)
 
     return calc_index
 
@@ -139,23 +133,21 @@ def pmi_reducer(key, rows):
         }
 
 
-def build_pmi_graph(input_stream):
+def build_pmi_graph(input_stream, workers=None):
     split_word_graph = ComputeGraph(source=input_stream)
-    split_word_graph.add_map(split_word_map)
+    split_word_graph.add_map(split_word_map, workers=workers, in_place=True)
 
     count_docs_graph = ComputeGraph(source=input_stream)
     count_docs_graph.add_fold(count_docs_fold)
 
     doc_filter_graph = ComputeGraph(source=split_word_graph)
     doc_filter_graph.add_join(on=count_docs_graph, strategy="inner")
-    doc_filter_graph.add_sort(sort_by="text")
-    doc_filter_graph.add_reduce(doc_filter_reducer, reduce_by="text")
+    doc_filter_graph.add_reduce(doc_filter_reducer, reduce_by="text", workers=workers, presorted=False)
 
     calc_pmi = ComputeGraph(source=split_word_graph)
     calc_pmi.add_sort(sort_by="text")
     calc_pmi.add_join(on=doc_filter_graph, join_by="text", strategy="inner")
-    calc_pmi.add_sort(sort_by="doc_id")
-    calc_pmi.add_reduce(pmi_reducer, reduce_by="doc_id")
+    calc_pmi.add_reduce(pmi_reducer, reduce_by="doc_id", workers=workers, presorted=False)
 
     return calc_pmi
 
@@ -176,6 +168,22 @@ def edges_mapper(row):
     yield res
 
 
+def distance_batch(start, end):
+    radius = 6371
+    start, end = np.radians(start), np.radians(end)
+    dlon = start[:, 0] - end[:, 0]
+    dlat = start[:, 1] - end[:, 1]
+    sq_sum = np.sin(dlat / 2) ** 2 + np.cos(start[:, 0]) * np.cos(start[:, 1]) * np.sin(dlon / 2) ** 2
+    return 2 * np.arctan2(np.sqrt(sq_sum), np.sqrt(1 - sq_sum)) * radius
+
+
+def edges_batch_mapper(batch):
+    return {
+        "edge_id": batch["edge_id"],
+        "length": distance_batch(batch["start"], batch["end"])
+    }
+
+
 def times_mapper(row):
     mask = "%Y%m%dT%H%M%S.%f"
     enter = datetime.datetime.strptime(row["enter_time"], mask)
@@ -188,27 +196,51 @@ def times_mapper(row):
     yield res
 
 
-def times_reducer(key, rows):
-    res = key
-    total_time = 0
-    total_dist = 0
-    for row in rows:
-        total_dist += row["length"]
-        total_time += row["time"]
-    res["speed"] = total_dist / total_time
-    yield res
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+# characters of ISO 8601 times: positions of characters of "%Y%m%dT%H%M%S.%f" times or separators
+ISO_CHARACTERS = (0, 1, 2, 3, "-", 4, 5, "-", 6, 7, 8, 9, 10, ":", 11, 12, ":", 13, 14, 15, 16, 17, 18, 19, 20, 21)
+
+
+def parse_times_batch(values):
+    """Parse "%Y%m%dT%H%M%S.%f" times to an array of datetime64 by rearranging their characters into ISO 8601"""
+    values = np.asarray(values, dtype=str)
+    values = np.where(np.char.find(values, ".") < 0, np.char.add(values, "."), values)
+    # fractions of seconds are padded to microseconds
+    chars = np.char.ljust(values, 22, "0").astype("U22").view(np.uint32).reshape(len(values), 22)
+    iso = np.empty((len(values), len(ISO_CHARACTERS)), dtype=np.uint32)
+    for i, character in enumerate(ISO_CHARACTERS):
+        iso[:, i] = ord(character) if isinstance(character, str) else chars[:, character]
+    return iso.view(f"U{len(ISO_CHARACTERS)}").reshape(-1).astype("datetime64[us]")
+
+
+def times_batch_mapper(batch):
+    enter = parse_times_batch(batch["enter_time"])
+    leave = parse_times_batch(batch["leave_time"])
+    days = enter.astype("datetime64[D]")
+    return {
+        "edge_id": batch["edge_id"],
+        "time": (leave - enter) / np.timedelta64(1, "h"),
+        "hour": (enter - days) // np.timedelta64(1, "h"),
+        # 1970-01-01 was Thursday
+        "weekday": np.array(WEEKDAYS)[(days.astype(np.int64) + 3) % 7],
+    }
 
 
-def build_yandex_maps_graph():
+def build_yandex_maps_graph(workers=None, vectorized=False):
     edges = ComputeGraph(source="edges_input")
-    edges.add_map(edges_mapper)
-    edges.add_sort(sort_by="edge_id")
+    if vectorized:
+        edges.add_map_batch(edges_batch_mapper)
+    else:
+        edges.add_map(edges_mapper, workers=workers, in_place=True)
 
     times = ComputeGraph(source="times_input")
-    times.add_map(times_mapper)
-    times.add_sort(sort_by="edge_id")
-    times.add_join(on=edges, join_by="edge_id")
-    times.add_sort(sort_by=("weekday", "hour"))
-    times.add_reduce(times_reducer, reduce_by=("weekday", "hour"))
+    if vectorized:
+        times.add_map_batch(times_batch_mapper)
+    else:
+        times.add_map(times_mapper, workers=workers, in_place=True)
+    times.add_join(on=edges, join_by="edge_id", algorithm="hash")
+    times.add_aggregate(
+        ("weekday", "hour"), {"speed": aggregations.sum("length") / aggregations.sum("time")}, sort=True
+    )
     times.add_sort(sort_by="hour")
     return times
@@ -0,0 +1,77 @@
+"""
+Synthetic inputs of the algorithms at any scale, the same for the same seed.
+
+Words of documents follow a Zipf distribution, as words of natural texts do.
+Road edges are short segments around a city center, travel times are trips
+over random edges at random moments of a week.
+"""
+
+from itertools import accumulate
+import bisect
+import datetime
+import random
+
+TIME_FORMAT = "%Y%m%dT%H%M%S.%f"
+
+
+def zipf_words(vocabulary_size, exponent=1.1):
+    """:return: words of the vocabulary and cumulative weights of the Zipf distribution over them"""
+    rng = random.Random(vocabulary_size)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = list()
+    seen = set()
+    while len(words) < vocabulary_size:
+        word = "".join(rng.choice(letters) for _ in range(rng.randint(2, 10)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    weights = list(accumulate(1 / rank ** exponent for rank in range(1, vocabulary_size + 1)))
+    return words, weights
+
+
+def zipf_docs(docs_count, words_per_doc=100, vocabulary_size=10000, seed=0):
+    """Documents {"doc_id", "text"} of words taken from a Zipf distribution, with some punctuation and capitals"""
+    rng = random.Random(seed)
+    words, weights = zipf_words(vocabulary_size)
+    total = weights[-1]
+    for doc_id in range(docs_count):
+        text = list()
+        for _ in range(words_per_doc):
+            word = words[bisect.bisect(weights, rng.random() * total)]
+            if rng.random() < 0.05:
+                word = word.capitalize()
+            if rng.random() < 0.05:
+                word += ","
+            text.append(word)
+        yield {"doc_id": doc_id, "text": " ".join(text)}
+
+
+def road_edges(edges_count, seed=0):
+    """Edges {"edge_id", "start", "end"} of a road graph, coordinates are [lon, lat]"""
+    rng = random.Random(seed)
+    for edge_id in range(edges_count):
+        start = [37.6 + rng.uniform(-0.3, 0.3), 55.75 + rng.uniform(-0.2, 0.2)]
+        end = [start[0] + rng.uniform(-0.005, 0.005), start[1] + rng.uniform(-0.003, 0.003)]
+        yield {"edge_id": str(edge_id), "start": start, "end": end}
+
+
+def travel_times(times_count, edges_count, seed=0):
+    """Trips {"edge_id", "enter_time", "leave_time"} over the edges of road_edges during a week"""
+    rng = random.Random(seed)
+    week_start = datetime.datetime(2017, 9, 11)
+    for _ in range(times_count):
+        enter = week_start + datetime.timedelta(seconds=rng.uniform(0, 7 * 24 * 3600))
+        leave = enter + datetime.timedelta(seconds=rng.uniform(5, 120))
+        yield {
+            "edge_id": str(rng.randrange(edges_count)),
+            "enter_time": enter.strftime(TIME_FORMAT),
+            "leave_time": leave.strftime(TIME_FORMAT),
+        }
+
+
+def keyed_rows(rows_count, keys_count, seed=0):
+    """Rows {"key", "value", "name"} for benchmarks of single operations"""
+    rng = random.Random(seed)
+    for _ in range(rows_count):
+        key = rng.randrange(keys_count)
+        yield {"key": key, "value": rng.random(), "name": f"name{key % 100}"}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of fusion of maps: chains of cheap mappers, with and without a fold after them,
+run with a generator for every map and with one fused generator for the chain.
+The mappers are declared in place, so that rows are copied once before the chain
+rather than by every map.
+"""
+
+import argparse
+import time
+from compgraph.compgraph.src import node
+from compgraph.compgraph.src.compgraph import ComputeGraph
+
+
+def inc_mapper(row):
+    row["value"] += 1
+    yield row
+
+
+def sum_folder(rows):
+    return {"value": sum(row["value"] for row in rows)}
+
+
+def build_graph(maps_count, fold):
+    graph = ComputeGraph(source="rows")
+    for _ in range(maps_count):
+        graph.add_map(inc_mapper, in_place=True)
+    if fold:
+        graph.add_fold(sum_folder)
+    return graph
+
+
+def measure(rows_count, maps_count, fold, fuse):
+    node._MapNode.fuse = fuse
+    rows = [{"key": i % 1000, "value": i} for i in range(rows_count)]
+    start = time.perf_counter()
+    for _ in build_graph(maps_count, fold).run(rows=rows):
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark of fusion of chains of maps")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--maps", default="1,2,4,8,16", help="comma-separated lengths of chains")
+    args = parser.parse_args()
+    print(f"{'maps':>6}{'fold':>6}{'separate, s':>13}{'fused, s':>10}{'speedup':>9}")
+    for maps_count in [int(count) for count in args.maps.split(",") if count]:
+        for fold in (False, True):
+            separate = measure(args.rows, maps_count, fold, fuse=False)
+            fused = measure(args.rows, maps_count, fold, fuse=True)
+            print(f"{maps_count:>6}{str(fold):>6}{separate:>13.3f}{fused:>10.3f}{separate / fused:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+"""
+Benchmark suite of the algorithms and of single operations on synthetic data.
+
+Every case is run for every size and number of workers of the sweep:
+throughput (rows of the biggest table per second), latency (time to the first row of the
+result) and peak memory traced during a run are measured. Results are saved
+to a JSON file by commit, and results worse than those of the previous commit
+in the file are flagged as regressions:
+
+    python -m compgraph.compgraph.benchmarks.suite --sizes 10000,100000 --workers 0,2
+    python -m compgraph.compgraph.benchmarks.suite --cases word_count,sort --check
+"""
+
+from collections import namedtuple
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from compgraph.compgraph import algorithms
+from compgraph.compgraph.src import aggregations
+from compgraph.compgraph.src.batch import np
+from compgraph.compgraph.src.compgraph import ComputeGraph
+from compgraph.compgraph.benchmarks import data
+
+# words in a synthetic document, so a graph over size / WORDS_PER_DOC documents reads about size words
+WORDS_PER_DOC = 100
+
+# build(size, workers) returns a graph, its sources and the number of rows of its biggest table (about size),
+# parallel tells if the case uses workers, so it's run once for every size otherwise
+Case = namedtuple("Case", ("name", "build", "parallel"))
+
+Result = namedtuple("Result", ("case", "size", "workers", "seconds", "rows_per_second", "latency", "peak_memory"))
+
+_inputs = dict()
+
+
+def cached_input(name, generate, *args):
+    """Inputs are generated once for all the cases and runs"""
+    key = (name,) + args
+    if key not in _inputs:
+        _inputs[key] = list(generate(*args))
+    return _inputs[key]
+
+
+def docs_input(size):
+    return cached_input("docs", data.zipf_docs, max(size // WORDS_PER_DOC, 2), WORDS_PER_DOC)
+
+
+def maps_input(size):
+    edges_count = max(size // 100, 10)
+    edges = cached_input("edges", data.road_edges, edges_count)
+    times = cached_input("times", data.travel_times, size, edges_count)
+    return edges, times
+
+
+def keys_count(size):
+    return max(size // 10, 1)
+
+
+def rows_input(size):
+    return cached_input("rows", data.keyed_rows, size, keys_count(size))
+
+
+def names_input(size):
+    return cached_input("names", lambda count: ({"key": key, "label": str(key)} for key in range(count)),
+                        keys_count(size))
+
+
+def word_count_case(size, workers):
+    docs = docs_input(size)
+    return algorithms.build_word_count_graph("docs", workers=workers), dict(docs=docs), len(docs) * WORDS_PER_DOC
+
+
+def inverted_index_case(size, workers):
+    docs = docs_input(size)
+    graph = algorithms.build_inverted_index_graph("docs", workers=workers)
+    return graph, dict(docs=docs), len(docs) * WORDS_PER_DOC
+
+
+def pmi_case(size, workers):
+    docs = docs_input(size)
+    return algorithms.build_pmi_graph("docs", workers=workers), dict(docs=docs), len(docs) * WORDS_PER_DOC
+
+
+def yandex_maps_case(size, workers, vectorized=False):
+    edges, times = maps_input(size)
+    graph = algorithms.build_yandex_maps_graph(workers=workers, vectorized=vectorized)
+    return graph, dict(edges_input=edges, times_input=times), len(times)
+
+
+def yandex_maps_vectorized_case(size, workers):
+    return yandex_maps_case(size, workers, vectorized=True)
+
+
+def double_mapper(row):
+    yield {"key": row["key"], "value": row["value"] * 2}
+
+
+def sum_reducer(key, rows):
+    yield {"key": key["key"], "value": sum(row["value"] for row in rows)}
+
+
+def count_folder(rows):
+    return {"count": sum(1 for _ in rows)}
+
+
+def double_batch_mapper(batch):
+    return {"key": batch["key"], "value": batch["value"] * 2}
+
+
+def operation_case(add_operations):
+    """
+    Case of a graph over keyed rows with the operations added by add_operations(graph, workers),
+    a graph joined to it may read one row for every key from "names"
+    """
+    def build(size, workers):
+        rows = rows_input(size)
+        graph = ComputeGraph(source="rows")
+        add_operations(graph, workers)
+        return graph, dict(rows=rows, names=names_input(size)), len(rows)
+    return build
+
+
+def join_operations(algorithm):
+    def add_operations(graph, workers):
+        names = ComputeGraph(source="names")
+        if algorithm == "merge":
+            names.add_sort("key")
+            graph.add_sort("key")
+        graph.add_join(names, join_by="key", algorithm=algorithm)
+    return add_operations
+
+
+CASES = [
+    Case("word_count", word_count_case, True),
+    Case("inverted_index", inverted_index_case, True),
+    Case("pmi", pmi_case, True),
+    Case("yandex_maps", yandex_maps_case, True),
+    Case("map", operation_case(lambda g, workers: g.add_map(double_mapper, workers=workers, pure=True)), True),
+    Case("sort", operation_case(lambda g, workers: g.add_sort(("key", "value"))), False),
+    Case("reduce", operation_case(
+        lambda g, workers: (g.add_sort("key"), g.add_reduce(sum_reducer, reduce_by="key", workers=workers))
+    ), True),
+    Case("hash_reduce", operation_case(
+        lambda g, workers: g.add_reduce(sum_reducer, reduce_by="key", workers=workers, presorted=False)
+    ), True),
+    Case("fold", operation_case(lambda g, workers: g.add_fold(count_folder)), False),
+    Case("aggregate", operation_case(
+        lambda g, workers: g.add_aggregate("key", {"value": aggregations.sum("value")})
+    ), False),
+    Case("top_k", operation_case(lambda g, workers: g.add_top_k(10, by="value", per="name")), False),
+    Case("hash_join", operation_case(join_operations("hash")), False),
+    Case("merge_join", operation_case(join_operations("merge")), False),
+]
+if np is not None:
+    CASES += [
+        Case("yandex_maps_vectorized", yandex_maps_vectorized_case, False),
+        Case("map_batch", operation_case(lambda g, workers: g.add_map_batch(double_batch_mapper)), False),
+    ]
+
+
+def run_once(graph, sources):
+    """:return: time of the run and time to the first row of the result"""
+    start = time.perf_counter()
+    rows = iter(graph.run(**sources))
+    next(rows, None)
+    latency = time.perf_counter() - start
+    for _ in rows:
+        pass
+    return time.perf_counter() - start, latency
+
+
+def peak_memory(graph, sources):
+    """:return: peak memory traced during a run, besides the inputs"""
+    tracemalloc.start()
+    try:
+        for _ in graph.run(**sources):
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(case, size, workers, repeat):
+    graph, sources, rows_count = case.build(size, workers or None)
+    # the first run warms up pools of workers and caches of the interpreter
+    run_once(graph, sources)
+    runs = [run_once(graph, sources) for _ in range(repeat)]
+    seconds = statistics.median(seconds for seconds, _ in runs)
+    latency = statistics.median(latency for _, latency in runs)
+    return Result(
+        case.name, size, workers, seconds, rows_count / seconds, latency, peak_memory(graph, sources)
+    )
+
+
+def sweep(cases, sizes, workers_counts, repeat):
+    for case in cases:
+        for size in sizes:
+            for workers in workers_counts if case.parallel else workers_counts[:1]:
+                yield measure(case, size, workers, repeat)
+
+
+def current_commit():
+    """:return: commit of the repository of the benchmarks, marked if there are uncommitted changes"""
+    repository = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=repository
+        ).stdout.strip()
+        changes = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True,
+            cwd=repository
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if changes else "")
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return list()
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_results(path, history, commit, results):
+    """Save results of the commit, replacing its results saved before"""
+    history = [run for run in history if run["commit"] != commit]
+    history.append({
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": [result._asdict() for result in results],
+    })
+    with open(path, "w") as file:
+        json.dump(history, file, indent=1)
+
+
+def find_regressions(history, commit, results, threshold):
+    """
+    Compare the results with the last results of another commit
+    :param threshold: relative change of throughput or peak memory treated as a regression
+    :return: commit compared with and descriptions of regressions
+    """
+    previous = [run for run in history if run["commit"] != commit]
+    if not previous:
+        return None, list()
+    baseline = previous[-1]
+    old_results = dict(
+        ((result["case"], result["size"], result["workers"]), result) for result in baseline["results"]
+    )
+    regressions = list()
+    for result in results:
+        old = old_results.get((result.case, result.size, result.workers))
+        if old is None:
+            continue
+        name = f"{result.case} (size {result.size}, workers {result.workers})"
+        if result.rows_per_second < old["rows_per_second"] * (1 - threshold):
+            regressions.append(
+                f"{name}: {result.rows_per_second:.0f} rows/s, was {old['rows_per_second']:.0f} rows/s"
+            )
+        # small tables are noise of the allocator
+        if result.peak_memory > old["peak_memory"] * (1 + threshold) + 2 ** 20:
+            regressions.append(
+                f"{name}: peak memory {result.peak_memory / 2 ** 20:.1f} MiB, "
+                f"was {old['peak_memory'] / 2 ** 20:.1f} MiB"
+            )
+    return baseline["commit"], regressions
+
+
+def print_header():
+    print(f"{'case':<24}{'size':>10}{'workers':>9}{'seconds':>10}{'rows/s':>12}{'latency':>10}"
+          f"{'peak MiB':>10}{'speedup':>9}")
+
+
+def print_result(result, base_seconds):
+    """:param base_seconds: time of the case for the same size with the first workers count of the sweep"""
+    print(f"{result.case:<24}{result.size:>10}{result.workers:>9}{result.seconds:>10.3f}"
+          f"{result.rows_per_second:>12.0f}{result.latency:>10.3f}{result.peak_memory / 2 ** 20:>10.1f}"
+          f"{base_seconds / result.seconds:>9.2f}", flush=True)
+
+
+def parse_list(value):
+    return [item for item in value.split(",") if item]
+
+
+def parse_numbers(value):
+    return [int(item) for item in parse_list(value)]
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmarks of the algorithms and of single operations")
+    parser.add_argument("--cases", type=parse_list, default=[case.name for case in CASES],
+                        help="comma-separated names of cases")
+    parser.add_argument("--sizes", type=parse_numbers, default=[10000, 100000],
+                        help="comma-separated numbers of rows of the biggest input tables")
+    parser.add_argument("--workers", type=parse_numbers, default=[0],
+                        help="comma-separated numbers of worker processes, 0 to run in place")
+    parser.add_argument("--repeat", type=int, default=3, help="number of measured runs, the median is taken")
+    parser.add_argument("--results", default="benchmark_results.json", help="JSON file with results by commit")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown or growth of memory flagged as a regression")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if there are regressions")
+    args = parser.parse_args()
+
+    cases = dict((case.name, case) for case in CASES)
+    unknown = [name for name in args.cases if name not in cases]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    results = list()
+    base_seconds = dict()
+    print_header()
+    for result in sweep([cases[name] for name in args.cases], args.sizes, args.workers, args.repeat):
+        results.append(result)
+        print_result(result, base_seconds.setdefault((result.case, result.size), result.seconds))
+
+    commit = current_commit()
+    history = load_history(args.results)
+    baseline, regressions = find_regressions(history, commit, results, args.threshold)
+    save_results(args.results, history, commit, results)
+    if baseline is not None:
+        print(f"\ncompared with {baseline}: {len(regressions)} regressions")
+    for regression in regressions:
+        print(f"    {regression}")
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
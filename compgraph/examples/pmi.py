@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 
-import json
+import sys
 import argparse
 from compgraph.compgraph.algorithms import build_pmi_graph
+from compgraph.compgraph.src.files import JsonLinesSource, JsonLinesSink
 
 
 def main():
@@ -10,11 +11,9 @@ def main():
     parser.add_argument("docs")
     parser.add_argument("travel_times")
     args = vars(parser.parse_args())
-    with open(args["docs"]) as docs_file:
-        g = build_pmi_graph('docs')
-        docs = iter(json.loads(row) for row in docs_file)
-        for row in g.run(docs=docs):
-            print(json.dumps(row))
+    g = build_pmi_graph('docs')
+    docs = JsonLinesSource(args["docs"], columns=("doc_id", "text"))
+    JsonLinesSink(sys.stdout).write_all(g.run(docs=docs))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
-import json
+import sys
 from compgraph.compgraph.algorithms import build_word_count_graph
+from compgraph.compgraph.src.files import JsonLinesSource, JsonLinesSink
 import argparse
 
 
@@ -10,11 +11,9 @@ def main():
     parser.add_argument("docs")
     parser.add_argument("travel_times")
     args = vars(parser.parse_args())
-    with open(args["docs"]) as docs_file:
-        g = build_word_count_graph('docs')
-        docs = iter(json.loads(row) for row in docs_file)
-        for row in g.run(docs=docs):
-            print(json.dumps(row))
+    g = build_word_count_graph('docs')
+    docs = JsonLinesSource(args["docs"], columns=("doc_id", "text"))
+    JsonLinesSink(sys.stdout).write_all(g.run(docs=docs))
 
 
 if __name__ == "__main__":
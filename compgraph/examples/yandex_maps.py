@@ -1,7 +1,8 @@
 #!/usr/bin/env python
-import json
+import sys
 import argparse
 from compgraph.compgraph.algorithms import build_yandex_maps_graph
+from compgraph.compgraph.src.files import JsonLinesSource, JsonLinesSink
 
 
 def main():
@@ -9,13 +10,10 @@ def main():
     parser.add_argument("graph_data")
     parser.add_argument("travel_times")
     args = vars(parser.parse_args())
-    with open(args["graph_data"]) as graph_data_stream:
-        with open(args["travel_times"]) as travel_times_stream:
-            graph_data = iter(json.loads(row) for row in graph_data_stream)
-            travel_times = iter(json.loads(row) for row in travel_times_stream)
-            g = build_yandex_maps_graph()
-            for row in g.run(edges_input=graph_data, times_input=travel_times):
-                print(json.dumps(row))
+    graph_data = JsonLinesSource(args["graph_data"], columns=("edge_id", "start", "end"))
+    travel_times = JsonLinesSource(args["travel_times"], columns=("edge_id", "enter_time", "leave_time"))
+    g = build_yandex_maps_graph()
+    JsonLinesSink(sys.stdout).write_all(g.run(edges_input=graph_data, times_input=travel_times))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+"""
+Aggregations for ComputeGraph.add_aggregate.
+
+Every aggregation keeps a partial state for a group of rows. A state is updated
+with the rows of the group one by one, and partial states of the same group
+computed separately (in different processes or before a spill to disk) are merged.
+Aggregations may be combined with arithmetic operators:
+
+    {"speed": sum("length") / sum("time")}
+"""
+
+import operator
+
+from .batch import np, batch_to_rows
+
+
+class Aggregation:
+    def init(self):
+        """State for an empty group"""
+        raise NotImplementedError
+
+    def update(self, state, row):
+        """:return: state with the row added"""
+        raise NotImplementedError
+
+    def merge(self, state, other):
+        """:return: state for the union of two parts of a group"""
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+    def update_batch(self, batch, groups, groups_count):
+        """
+        Aggregate a columnar batch of rows
+        :param groups: array with a group number for every row of the batch
+        :return: list of states for every group
+        """
+        states = [self.init() for _ in range(groups_count)]
+        for group, row in zip(groups.tolist(), batch_to_rows(batch)):
+            states[group] = self.update(states[group], row)
+        return states
+
+    def __add__(self, other):
+        return _Combination(operator.add, self, other)
+
+    def __radd__(self, other):
+        return _Combination(operator.add, other, self)
+
+    def __sub__(self, other):
+        return _Combination(operator.sub, self, other)
+
+    def __rsub__(self, other):
+        return _Combination(operator.sub, other, self)
+
+    def __mul__(self, other):
+        return _Combination(operator.mul, self, other)
+
+    def __rmul__(self, other):
+        return _Combination(operator.mul, other, self)
+
+    def __truediv__(self, other):
+        return _Combination(operator.truediv, self, other)
+
+    def __rtruediv__(self, other):
+        return _Combination(operator.truediv, other, self)
+
+
+class _Constant(Aggregation):
+    def __init__(self, value):
+        self.value = value
+
+    def init(self):
+        return None
+
+    def update(self, state, row):
+        return None
+
+    def merge(self, state, other):
+        return None
+
+    def update_batch(self, batch, groups, groups_count):
+        return [None] * groups_count
+
+    def result(self, state):
+        return self.value
+
+
+class _Combination(Aggregation):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left if isinstance(left, Aggregation) else _Constant(left)
+        self.right = right if isinstance(right, Aggregation) else _Constant(right)
+
+    def init(self):
+        return self.left.init(), self.right.init()
+
+    def update(self, state, row):
+        return self.left.update(state[0], row), self.right.update(state[1], row)
+
+    def merge(self, state, other):
+        return self.left.merge(state[0], other[0]), self.right.merge(state[1], other[1])
+
+    def update_batch(self, batch, groups, groups_count):
+        return list(zip(
+            self.left.update_batch(batch, groups, groups_count), self.right.update_batch(batch, groups, groups_count)
+        ))
+
+    def result(self, state):
+        return self.op(self.left.result(state[0]), self.right.result(state[1]))
+
+
+class _Count(Aggregation):
+    def init(self):
+        return 0
+
+    def update(self, state, row):
+        return state + 1
+
+    def merge(self, state, other):
+        return state + other
+
+    def update_batch(self, batch, groups, groups_count):
+        return np.bincount(groups, minlength=groups_count).tolist()
+
+
+class _Sum(Aggregation):
+    def __init__(self, column):
+        self.column = column
+
+    def init(self):
+        return 0
+
+    def update(self, state, row):
+        return state + row[self.column]
+
+    def merge(self, state, other):
+        return state + other
+
+    def update_batch(self, batch, groups, groups_count):
+        values = batch[self.column]
+        totals = np.zeros(groups_count, dtype=values.dtype)
+        np.add.at(totals, groups, values)
+        return totals.tolist()
+
+
+class _Min(Aggregation):
+    def __init__(self, column):
+        self.column = column
+
+    def init(self):
+        return None
+
+    def update(self, state, row):
+        value = row[self.column]
+        return value if state is None or value < state else state
+
+    def merge(self, state, other):
+        if state is None or (other is not None and other < state):
+            return other
+        return state
+
+    def update_batch(self, batch, groups, groups_count):
+        values = batch[self.column]
+        # rows ordered by group and value, the first row of every group has its min value
+        order = np.lexsort((values, groups))
+        first_rows = order[np.unique(groups[order], return_index=True)[1]]
+        return values[first_rows].tolist()
+
+
+class _Max(_Min):
+    def update(self, state, row):
+        value = row[self.column]
+        return value if state is None or value > state else state
+
+    def merge(self, state, other):
+        if state is None or (other is not None and other > state):
+            return other
+        return state
+
+    def update_batch(self, batch, groups, groups_count):
+        values = batch[self.column]
+        order = np.lexsort((values, groups))
+        last_rows = order[len(order) - 1 - np.unique(groups[order][::-1], return_index=True)[1]]
+        return values[last_rows].tolist()
+
+
+class _Mean(Aggregation):
+    def __init__(self, column):
+        self.column = column
+
+    def init(self):
+        return 0, 0
+
+    def update(self, state, row):
+        return state[0] + row[self.column], state[1] + 1
+
+    def merge(self, state, other):
+        return state[0] + other[0], state[1] + other[1]
+
+    def update_batch(self, batch, groups, groups_count):
+        return list(zip(
+            _Sum(self.column).update_batch(batch, groups, groups_count),
+            _Count().update_batch(batch, groups, groups_count)
+        ))
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else None
+
+
+def merge_states(aggregations, states, other):
+    """Merge lists of partial states of the aggregations"""
+    return [
+        aggregation.merge(state, other_state)
+        for aggregation, state, other_state in zip(aggregations, states, other)
+    ]
+
+
+def count():
+    """Number of rows in a group"""
+    return _Count()
+
+
+def sum(column):
+    """Sum of the column over a group"""
+    return _Sum(column)
+
+
+def min(column):
+    """Min value of the column in a group"""
+    return _Min(column)
+
+
+def max(column):
+    """Max value of the column in a group"""
+    return _Max(column)
+
+
+def mean(column):
+    """Mean value of the column in a group"""
+    return _Mean(column)
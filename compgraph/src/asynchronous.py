@@ -0,0 +1,84 @@
+"""
+Helpers to run async mappers and to read async iterables in the synchronous engine.
+
+Coroutines run on an event loop in another thread than the operations:
+the loop of the caller of ComputeGraph.run_async, which runs the graph in
+a thread of its executor, or a loop started for the operation by ComputeGraph.run.
+"""
+
+from contextlib import contextmanager
+import asyncio
+import threading
+
+from .parallel import pool_map
+
+
+async def collect_rows(mapper, row):
+    return [res_row async for res_row in mapper(row)]
+
+
+async def next_row(iterator):
+    return await iterator.__anext__()
+
+
+async def cancel_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class LoopExecutor:
+    """Executor of coroutine functions on an event loop running in another thread, for pool_map"""
+    def __init__(self, loop):
+        self.loop = loop
+
+    def submit(self, function, *args):
+        return asyncio.run_coroutine_threadsafe(function(*args), self.loop)
+
+
+@contextmanager
+def event_loop(loop=None):
+    """Yield the loop if given, or a new loop running in a thread until the end of the block"""
+    if loop is not None:
+        yield loop
+        return
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield loop
+    finally:
+        # coroutines of rows which weren't taken are left if the map is stopped early
+        asyncio.run_coroutine_threadsafe(cancel_tasks(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def async_map(mapper, rows, max_in_flight, ordered=True, loop=None):
+    """
+    Run an async generator mapper over rows, keeping at most max_in_flight rows mapped at once
+    :param loop: event loop running in another thread, a new one by default
+    """
+    with event_loop(loop) as loop:
+        tasks = ((mapper, row) for row in rows)
+        for res_rows in pool_map(LoopExecutor(loop), collect_rows, tasks, max_in_flight, ordered):
+            for res_row in res_rows:
+                yield res_row
+
+
+class AsyncSource:
+    """Iterable over rows of an async iterable, which is read on an event loop running in another thread"""
+    def __init__(self, source, loop):
+        self.source = source
+        self.loop = loop
+
+    def __iter__(self):
+        iterator = self.source.__aiter__()
+        while True:
+            try:
+                row = asyncio.run_coroutine_threadsafe(next_row(iterator), self.loop).result()
+            except StopAsyncIteration:
+                return
+            yield row
@@ -0,0 +1,112 @@
+"""
+Columnar batches of rows for vectorized operations.
+
+A batch is a dict of column names and NumPy arrays of equal length.
+All rows of a batch should have the same columns.
+NumPy is an optional dependency, it is needed only for batch operations.
+"""
+
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch operations")
+
+
+def rows_to_batch(rows):
+    if not rows:
+        return dict()
+    return dict((col, np.array([row[col] for row in rows])) for col in rows[0])
+
+
+def batch_to_rows(batch):
+    columns = list(batch)
+    if not columns:
+        return
+    for values in zip(*(batch[col].tolist() for col in columns)):
+        yield dict(zip(columns, values))
+
+
+def batch_length(batch):
+    return len(next(iter(batch.values()))) if batch else 0
+
+
+def concat_batches(batches):
+    batches = [batch for batch in batches if batch_length(batch)]
+    if not batches:
+        return dict()
+    return dict((col, np.concatenate([batch[col] for batch in batches])) for col in batches[0])
+
+
+def take(batch, indexes):
+    return dict((col, values[indexes]) for col, values in batch.items())
+
+
+def source_batches(source, batch_size):
+    """Iterate over a node or an iterable of rows by batches"""
+    if getattr(source, "produces_batches", False):
+        for batch in source.iter_batches():
+            yield batch
+        return
+    rows = iter(source)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            return
+        yield rows_to_batch(chunk)
+
+
+def group_indexes(batch, columns):
+    """
+    :return: keys of groups as a list of tuples and an array with a group number for every row
+    """
+    if not columns:
+        return [()], np.zeros(batch_length(batch), dtype=np.intp)
+    codes = list()
+    uniques = list()
+    for col in columns:
+        unique, inverse = np.unique(batch[col], return_inverse=True)
+        uniques.append(unique.tolist())
+        codes.append(inverse)
+    group_codes, inverse = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+    keys = [tuple(uniques[i][code] for i, code in enumerate(row)) for row in group_codes.tolist()]
+    return keys, inverse.reshape(-1)
+
+
+def key_codes(left, right, columns):
+    """:return: arrays of integer codes of keys of rows of two batches, equal for equal keys"""
+    length = batch_length(left)
+    codes = np.zeros(length + batch_length(right), dtype=np.intp)
+    for col in columns:
+        unique, inverse = np.unique(np.concatenate([left[col], right[col]]), return_inverse=True)
+        # codes are made dense again after every column, so they don't overflow
+        _, codes = np.unique(codes * len(unique) + inverse.reshape(-1), return_inverse=True)
+        codes = codes.reshape(-1)
+    return codes[:length], codes[length:]
+
+
+def join_batches(left, right, join_by):
+    """
+    Inner join of two batches by the join_by columns, every left row is joined with all right rows
+    of its key in turn, as rows are joined by merge_dicts
+    """
+    left_codes, right_codes = key_codes(left, right, join_by)
+    order = np.argsort(right_codes, kind="stable")
+    sorted_codes = right_codes[order]
+    starts = np.searchsorted(sorted_codes, left_codes, "left")
+    counts = np.searchsorted(sorted_codes, left_codes, "right") - starts
+    left_indexes = np.repeat(np.arange(len(left_codes)), counts)
+    # position of every joined row among the right rows of its key
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    right_indexes = order[np.repeat(starts, counts) + offsets]
+    joined = take(left, left_indexes)
+    for col, values in right.items():
+        if col not in join_by:
+            joined["." + col if col in left else col] = values[right_indexes]
+    return joined
@@ -0,0 +1,186 @@
+"""
+Persistent cache of results of graphs.
+
+A result is keyed by a fingerprint of the graph: its operations with their
+parameters (code of mappers, reducers and other functions included, with values
+of their closures and of the globals they read, and code of module-level helper
+functions they call) and fingerprints of its sources, recursively for source
+and joined graphs.
+Sources given to run are fingerprinted by their data: lists of rows are
+hashed, and objects with a fingerprint method (e.g. JsonLinesSource) describe
+themselves. Graphs reading other iterables are not cached.
+
+    cache = ResultCache("/tmp/compgraph-cache", max_size=2 ** 30)
+    graph.run(docs=JsonLinesSource("docs.jsonl"), cache=cache)
+"""
+
+from functools import partial
+from threading import Lock
+import hashlib
+import os
+import pickle
+import types
+
+from .parallel import batches
+from .store import DiskStore
+
+
+class Uncacheable(Exception):
+    """A graph reads a source or calls a function which can't be fingerprinted"""
+
+
+def digest(value):
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+def function_fingerprint(function, graph_key, seen=None):
+    """
+    Name of a function with a hash of its code, defaults, values of its closure and of the globals it reads,
+    recursively for functions it calls by global names or keeps in its closure
+    :param seen: codes of functions being fingerprinted, to stop at recursive functions
+    :raise Uncacheable: if values read by the function can't be fingerprinted, e.g. refer to themselves
+    """
+    code = getattr(function, "__code__", None)
+    name = f"{getattr(function, '__module__', None)}.{getattr(function, '__qualname__', repr(function))}"
+    if code is None:
+        return name
+    seen = seen if seen is not None else set()
+    if code in seen:
+        return name
+    seen.add(code)
+    function_globals = getattr(function, "__globals__", {})
+    try:
+        closure = [value_fingerprint(cell.cell_contents, graph_key, seen) for cell in function.__closure__ or ()]
+        # modules are read by their attributes, which are not fingerprinted
+        referenced = [
+            (global_name, value_fingerprint(function_globals[global_name], graph_key, seen))
+            for global_name in sorted(code_names(code))
+            if global_name in function_globals and not isinstance(function_globals[global_name], types.ModuleType)
+        ]
+        defaults = fingerprint(function.__defaults__, graph_key)
+    except RecursionError:
+        raise Uncacheable(name)
+    return name, code_fingerprint(code), defaults, closure, referenced
+
+
+def value_fingerprint(value, graph_key, seen):
+    """Fingerprint of a value read by a function, functions are fingerprinted with their helpers"""
+    if isinstance(value, types.FunctionType):
+        return function_fingerprint(value, graph_key, seen)
+    return fingerprint(value, graph_key)
+
+
+def code_names(code):
+    """Global names used by a code and by codes of functions defined in it"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= code_names(const)
+    return names
+
+
+def code_fingerprint(code):
+    consts = tuple(code_fingerprint(const) if isinstance(const, types.CodeType) else repr(const)
+                   for const in code.co_consts)
+    return digest((code.co_code, consts, code.co_names))
+
+
+def fingerprint(value, graph_key):
+    """
+    Stable description of a parameter of an operation
+    :param graph_key: function returning a key of a graph
+    """
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(fingerprint(item, graph_key) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(repr(fingerprint(item, graph_key)) for item in value))
+    if isinstance(value, dict):
+        return tuple((key, fingerprint(item, graph_key)) for key, item in value.items())
+    if hasattr(value, "_nodes"):
+        return graph_key(value)
+    if isinstance(value, type):
+        return f"{value.__module__}.{value.__qualname__}"
+    if isinstance(value, partial):
+        return fingerprint((value.func, value.args, value.keywords), graph_key)
+    if isinstance(value, types.MethodType):
+        return fingerprint(value.__self__, graph_key), function_fingerprint(value.__func__, graph_key)
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+        return function_fingerprint(value, graph_key)
+    if hasattr(value, "__dict__"):
+        return type(value).__qualname__, fingerprint(vars(value), graph_key)
+    return repr(value)
+
+
+def source_fingerprint(source):
+    """:return: hash of data of a source of a graph, None if it can't be hashed without reading it"""
+    if hasattr(source, "fingerprint"):
+        return source.fingerprint()
+    if isinstance(source, (list, tuple)):
+        hash = hashlib.sha256()
+        for batch in batches(source, 1000):
+            hash.update(pickle.dumps(batch, pickle.HIGHEST_PROTOCOL))
+        return hash.hexdigest()
+    return None
+
+
+class ResultCache:
+    """
+    Directory of results of graphs, the least recently used results
+    are removed when the total size exceeds the limit
+    """
+    def __init__(self, directory, max_size=2 ** 30):
+        """
+        :param max_size: max total size of the results in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".store")
+
+    def get(self, key):
+        """:return: store with the result for the key, None if there is none"""
+        path = self.path(key)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            # the modification time of a result is the time it was used last
+            os.utime(path)
+            return DiskStore.open(path)
+
+    def put(self, key, rows):
+        """
+        Save the result for the key
+        :return: store with the result
+        """
+        path = self.path(key)
+        # the result is written to a temporary file, so that it's never read unfinished
+        DiskStore(path=path + ".tmp").write_all(rows).close()
+        with self.lock:
+            os.replace(path + ".tmp", path)
+            self.evict()
+            return DiskStore.open(path)
+
+    def evict(self):
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith(".store"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in entries)
+        # the last result is kept even if it alone exceeds the limit
+        for _, size, name in sorted(entries)[:-1]:
+            if total_size <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total_size -= size
+
+    def clear(self):
+        with self.lock:
+            for name in os.listdir(self.directory):
+                if name.endswith(".store"):
+                    os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,588 @@
+"""
+Runner of graphs on a cluster of worker processes talking over sockets.
+
+    with Cluster(workers=4) as cluster:
+        rows = cluster.run(graph, docs=docs)
+
+The coordinator splits every graph into stages at operations which need all
+rows of a key together: reduces, aggregations, joins, top-k, folds and limits.
+A stage is run by tasks, one for every split of an input or partition of the
+previous stage. The output of a task is hash-partitioned by the key of the next
+stage and kept by its worker, which serves the partitions to tasks of the next
+stage (the shuffle). Sorts before such operations are done after the shuffle.
+Blocks of a partition are merged by the order of the stage which wrote them,
+so partitions stay sorted, and the result is merged from sorted partitions.
+
+Failed tasks are retried, on other workers if possible. If a worker dies,
+its running task is retried and the tasks whose outputs it kept are run again.
+
+Workers are local processes by default; workers on other machines run
+run_worker(coordinator_address, authkey, host) and are awaited by a cluster
+created with remote_workers and an address and authkey known to them.
+Mappers, reducers and other functions of the graphs are sent to the workers,
+so they should be picklable, i.e. defined at the module level.
+"""
+
+from collections import deque, defaultdict
+from itertools import chain, count
+from multiprocessing import AuthenticationError, Process
+from multiprocessing.connection import Listener, Client, wait
+import copy
+import heapq
+import os
+import pickle
+import threading
+import traceback
+import zlib
+
+from .node import (
+    _MapNode, _ReduceNode, _SortNode, _FoldNode, _JoinNode, _AggregateNode, _TopKNode, _LimitNode, _InitNode,
+    is_prefix
+)
+from .keys import key_getter
+from .parallel import batches
+
+
+class LostBlock(Exception):
+    """A block of a shuffle can't be read from the worker which kept it"""
+    def __init__(self, address):
+        super(LostBlock, self).__init__(address)
+        self.address = address
+
+
+def canonical_key(key):
+    """Key with equal numbers of different types (True, 1 and 1.0) made the same"""
+    if isinstance(key, tuple):
+        return tuple(canonical_key(item) for item in key)
+    if isinstance(key, float) and key.is_integer():
+        return int(key)
+    if isinstance(key, bool):
+        return int(key)
+    return key
+
+
+def partition_index(key, partitions_count):
+    """Partition of a key, the same in all processes unlike hash() of strings, and for all keys equal to it"""
+    return zlib.crc32(repr(canonical_key(key)).encode()) % partitions_count
+
+
+def merge_blocks(blocks, order):
+    """Merge blocks sorted by the order columns, or chain them if there is no order"""
+    if order and len(blocks) > 1:
+        return heapq.merge(*blocks, key=key_getter(order))
+    return chain.from_iterable(blocks)
+
+
+def fetch_blocks(locations, authkey, local_address=None, local_blocks=None):
+    """
+    Read blocks from the workers keeping them
+    :param locations: list of (data address of a worker, block id)
+    :return: list of lists of rows of the blocks
+    """
+    by_address = defaultdict(list)
+    for address, block_id in locations:
+        by_address[address].append(block_id)
+    fetched = dict()
+    for address, block_ids in by_address.items():
+        if address == local_address:
+            for block_id in block_ids:
+                fetched[address, block_id] = local_blocks.get(block_id)
+            continue
+        try:
+            with Client(address, authkey=authkey) as conn:
+                for block_id in block_ids:
+                    conn.send(block_id)
+                    fetched[address, block_id] = conn.recv()
+        except (OSError, EOFError):
+            raise LostBlock(address)
+    blocks = list()
+    for location in locations:
+        if fetched[location] is None:
+            raise LostBlock(location[0])
+        blocks.append(fetched[location])
+    return blocks
+
+
+def read_input(spec, authkey, local_address=None, local_blocks=None):
+    """Rows of a resolved input of a task: ("rows", rows) or ("blocks", locations, order)"""
+    if spec[0] == "rows":
+        return spec[1]
+    _, locations, order = spec
+    return merge_blocks(fetch_blocks(locations, authkey, local_address, local_blocks), order)
+
+
+class _Table:
+    """Rows of the right table of a join in a task, in place of the joined graph"""
+    _store = True
+
+    def __init__(self, rows):
+        self._result = rows
+
+    def _output_owned(self):
+        return True
+
+    def _get_last_node(self):
+        return None
+
+
+def execute_task(spec, authkey, local_address, blocks, task_id):
+    """
+    Run operations of a task over its input and keep the partitions of its output in blocks
+    :return: numbers of rows of the partitions
+    """
+    ops, schema, input_spec, rights, output_key, partitions_count = spec
+    rows = read_input(input_spec, authkey, local_address, blocks)
+    if schema is not None:
+        rows = map(schema.record, rows)
+    for i, node in enumerate(ops):
+        if i in rights:
+            node.on = _Table(list(read_input(rights[i], authkey, local_address, blocks)))
+        node.set_source(rows)
+        rows = node
+    partitions = [list() for _ in range(partitions_count)]
+    if output_key is None:
+        partitions[0].extend(rows)
+    else:
+        key = key_getter(output_key)
+        for row in rows:
+            partitions[partition_index(key(row), partitions_count)].append(row)
+    for i, partition in enumerate(partitions):
+        blocks[task_id, i] = partition
+    return [len(partition) for partition in partitions]
+
+
+def serve_blocks(listener, blocks):
+    while True:
+        try:
+            conn = listener.accept()
+        except AuthenticationError:
+            continue
+        except OSError:
+            return
+        threading.Thread(target=serve_connection, args=(conn, blocks), daemon=True).start()
+
+
+def serve_connection(conn, blocks):
+    with conn:
+        while True:
+            try:
+                block_id = conn.recv()
+            except (EOFError, OSError):
+                return
+            conn.send(blocks.get(block_id))
+
+
+def run_worker(coordinator_address, authkey, host="localhost"):
+    """
+    Run a worker: connect to the coordinator and run its tasks until it stops
+    :param host: host to serve blocks of shuffles on, reachable by other workers
+    """
+    blocks = dict()
+    listener = Listener((host, 0), authkey=authkey)
+    threading.Thread(target=serve_blocks, args=(listener, blocks), daemon=True).start()
+    with Client(coordinator_address, authkey=authkey) as conn:
+        conn.send(("ready", listener.address, os.getpid()))
+        while True:
+            try:
+                message = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            try:
+                message = pickle.loads(message)
+                if message[0] == "stop":
+                    break
+                if message[0] == "clear":
+                    blocks.clear()
+                    continue
+                _, task_id, spec = message
+                reply = ("done", task_id, execute_task(spec, authkey, listener.address, blocks, task_id))
+            except LostBlock as error:
+                reply = ("lost", error.address)
+            except Exception:
+                reply = ("failed", traceback.format_exc())
+            conn.send_bytes(pickle.dumps(reply, pickle.HIGHEST_PROTOCOL))
+    listener.close()
+
+
+class _Worker:
+    def __init__(self, conn, data_address, process=None):
+        self.conn = conn
+        self.data_address = data_address
+        self.process = process
+        self.alive = True
+
+
+class _Task:
+    def __init__(self, task_id, stage, input_ref, rights):
+        """
+        :param stage: _Stage the task belongs to
+        :param input_ref: ("rows", rows) or ("partition", dataset, index)
+        :param rights: dict of indexes of joins in the operations and refs of their right tables,
+            ("partition", dataset, index) or ("all", dataset)
+        """
+        self.id = task_id
+        self.stage = stage
+        self.input_ref = input_ref
+        self.rights = rights
+        self.worker = None
+        self.counts = None
+        self.attempts = 0
+        self.failed_on = set()
+
+    def refs(self):
+        return [self.input_ref] + list(self.rights.values())
+
+    def lost_inputs(self):
+        """:return: tasks which wrote inputs of the task and whose workers are dead"""
+        lost = list()
+        for ref in self.refs():
+            if ref[0] != "rows":
+                lost.extend(task for task in ref[1].tasks if not task.worker.alive and task not in lost)
+        return lost
+
+    def spec(self):
+        stage = self.stage
+        rights = dict((i, resolve(ref)) for i, ref in self.rights.items())
+        return stage.ops, stage.schema, resolve(self.input_ref), rights, stage.output_key, stage.partitions_count
+
+
+class _Stage:
+    """Operations run by tasks over partitions of an input, and partitioning of their output"""
+    def __init__(self, ops, schema, output_key, partitions_count):
+        """
+        :param output_key: columns to hash-partition the output by, None to keep it as one partition of the task
+        """
+        self.ops = ops
+        self.schema = schema
+        self.output_key = output_key
+        self.partitions_count = partitions_count
+
+
+class _Dataset:
+    """Table kept by workers in blocks written by tasks of a stage"""
+    def __init__(self, tasks, order, partitioned):
+        """
+        :param order: columns every partition is sorted by
+        :param partitioned: whether every task wrote a block of every partition,
+            otherwise the output of every task is a partition
+        """
+        self.tasks = tasks
+        self.order = order
+        self.partitioned = partitioned
+        self.partitions_count = tasks[0].stage.partitions_count if partitioned else len(tasks)
+
+    def locations(self, index):
+        """:return: (data address of a worker, block id) of non-empty blocks of a partition"""
+        if not self.partitioned:
+            task = self.tasks[index]
+            return [(task.worker.data_address, (task.id, 0))]
+        return [
+            (task.worker.data_address, (task.id, index)) for task in self.tasks if task.counts[index]
+        ]
+
+
+def resolve(ref):
+    """Input of a task for a worker: rows, or locations of blocks with their order"""
+    if ref[0] == "rows":
+        return ref
+    if ref[0] == "partition":
+        _, dataset, index = ref
+        return "blocks", dataset.locations(index), dataset.order
+    _, dataset = ref
+    locations = [location for index in range(dataset.partitions_count) for location in dataset.locations(index)]
+    return "blocks", locations, dataset.order
+
+
+class Cluster:
+    """Coordinator of worker processes running graphs"""
+    def __init__(self, workers=2, remote_workers=0, address=("localhost", 0), authkey=None, partitions=None,
+                 split_size=10000, max_retries=3):
+        """
+        :param workers: number of local worker processes to start
+        :param remote_workers: number of workers started elsewhere by run_worker to wait for
+        :param address: address for workers to connect to the coordinator
+        :param partitions: number of partitions of shuffles, the number of workers by default
+        :param split_size: number of rows of a source sent to a task
+        :param max_retries: number of times a failed task is retried before the run fails
+        """
+        self.workers_count = workers
+        self.remote_workers = remote_workers
+        self.address = address
+        self.authkey = authkey or os.urandom(16)
+        self.partitions = partitions
+        self.split_size = split_size
+        self.max_retries = max_retries
+        self._workers = list()
+        self._listener = None
+        self._task_ids = count()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        self._listener = Listener(self.address, authkey=self.authkey)
+        processes = list()
+        for _ in range(self.workers_count):
+            process = Process(target=run_worker, args=(self._listener.address, self.authkey), daemon=True)
+            process.start()
+            processes.append(process)
+        processes = dict((process.pid, process) for process in processes)
+        for _ in range(self.workers_count + self.remote_workers):
+            conn = self._listener.accept()
+            _, data_address, pid = conn.recv()
+            self._workers.append(_Worker(conn, data_address, processes.get(pid)))
+
+    def close(self):
+        for worker in self._workers:
+            if worker.alive:
+                try:
+                    worker.conn.send_bytes(pickle.dumps(("stop",)))
+                except OSError:
+                    pass
+                worker.conn.close()
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        self._workers = list()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def run(self, graph, **sources):
+        """
+        Run the graph and all its dependencies on the workers
+        :param sources: iterables or graphs for inputs with names due to args
+        :return: list of rows of the result table
+        """
+        graphs = list()
+        used_graphs = dict()
+        for source_graph in sources.values():
+            if hasattr(source_graph, "_nodes"):
+                source_graph._topsort_dependent_graphs(graphs, used_graphs, **sources)
+        graph._topsort_dependent_graphs(graphs, used_graphs, **sources)
+
+        splits = dict()
+        datasets = dict()
+        try:
+            for g in graphs:
+                g._store = False
+                g._plan(sources)
+                datasets[g] = self._run_graph(g, sources, splits, datasets)
+            return self._collect(datasets[graph])
+        finally:
+            for worker in self._alive_workers():
+                worker.conn.send_bytes(pickle.dumps(("clear",)))
+
+    def _alive_workers(self):
+        return [worker for worker in self._workers if worker.alive]
+
+    def _partitions_count(self, key):
+        # all rows go to one partition for operations over the whole table
+        return (self.partitions or len(self._workers)) if key else 1
+
+    def _run_graph(self, graph, sources, splits, datasets):
+        """:return: _Dataset of the result of the graph"""
+        source = sources.get(graph._main_source_name, graph._main_source)
+        if hasattr(source, "_nodes"):
+            data, data_order = datasets[source], source._sorted_by
+        else:
+            if graph._main_source_name not in splits:
+                splits[graph._main_source_name] = list(batches(source, self.split_size)) or [[]]
+            data, data_order = splits[graph._main_source_name], ()
+        schema = graph._schema
+        # the input node of an empty graph reads the source, which the tasks do themselves
+        nodes = [node for node in graph._nodes if not isinstance(node, _InitNode)]
+
+        # orders of the table before and after every operation, as the planner has seen them
+        orders = [data_order]
+        for node in nodes:
+            orders.append(node.plan(orders[-1]))
+
+        # operations of the current stage with orders of their output, and right inputs of its joins
+        ops = list()
+        rights = dict()
+        # operations which should stay in the current stage, up to the last one reading a shuffle
+        fixed = 0
+        for node, input_order, order in zip(nodes, orders, orders[1:]):
+            key = self._colocation_key(node)
+            if key is not None:
+                # sorts for the operation are done after the shuffle
+                split = next((i for i in range(fixed, len(ops)) if isinstance(ops[i][0], _SortNode)), len(ops))
+                stage_order = ops[split - 1][1] if split else data_order
+                stage_rights = dict((i, right) for i, right in rights.items() if i < split)
+                data = self._run_stage(data, [op for op, _ in ops[:split]], schema, stage_rights, key, stage_order)
+                data_order = stage_order
+                schema = None
+                rights = dict((i - split, right) for i, right in rights.items() if i >= split)
+                ops = ops[split:]
+            if isinstance(node, _JoinNode):
+                rights[len(ops)] = self._join_input(node, datasets)
+            ops.append((self._task_node(node, input_order), order))
+            if key is not None:
+                fixed = len(ops)
+        if ops or not isinstance(data, _Dataset):
+            data = self._run_stage(data, [op for op, _ in ops], schema, rights, None, orders[-1])
+        return data
+
+    def _colocation_key(self, node):
+        """:return: columns rows of the same values of which should be in one partition for the node, if any"""
+        if isinstance(node, _ReduceNode):
+            return tuple(node.reduce_by)
+        if isinstance(node, _AggregateNode):
+            return tuple(node.group_by)
+        if isinstance(node, _TopKNode):
+            return tuple(node.per)
+        if isinstance(node, _JoinNode) and not self._broadcast(node):
+            return tuple(node.join_by)
+        if isinstance(node, (_FoldNode, _LimitNode)):
+            return ()
+        return None
+
+    @staticmethod
+    def _broadcast(node):
+        """Whether the whole right table of the join is sent to every task, so the left one isn't shuffled"""
+        if node.algorithm == "broadcast":
+            return True
+        return node.algorithm == "auto" and node.strategy in ("inner", "left") and (
+            isinstance(node.on._get_last_node(), _FoldNode) or not node.join_by
+        )
+
+    def _join_input(self, node, datasets):
+        right = datasets[node.on]
+        if self._broadcast(node):
+            return "all", right
+        # the right table is shuffled by the key of the join into the partitions of the left one
+        return "shuffled", self._run_stage(right, [], None, dict(), tuple(node.join_by), node.on._sorted_by)
+
+    def _task_node(self, node, input_order):
+        """Copy of the node to be sent to workers"""
+        node = copy.copy(node)
+        node.source = None
+        if isinstance(node, (_MapNode, _ReduceNode)):
+            # workers of the cluster replace pools of processes
+            node.workers = None
+        if isinstance(node, _JoinNode):
+            if self._broadcast(node):
+                node.algorithm = "broadcast"
+            elif node.algorithm == "auto":
+                sorted_inputs = is_prefix(node.join_by, input_order) and is_prefix(node.join_by, node.on._sorted_by)
+                node.algorithm = "merge" if sorted_inputs else "hash"
+            node.on = None
+        return node
+
+    def _run_stage(self, data, ops, schema, rights, output_key, order):
+        """
+        Run a stage over splits of a source or partitions of a dataset
+        :param rights: dict of indexes of joins in ops and their right inputs
+        :param order: columns the output of the operations is sorted by
+        """
+        stage = _Stage(ops, schema, output_key, self._partitions_count(output_key) if output_key is not None else 1)
+        if isinstance(data, _Dataset):
+            input_refs = [("partition", data, i) for i in range(data.partitions_count)]
+        else:
+            input_refs = [("rows", split) for split in data]
+        tasks = list()
+        for i, input_ref in enumerate(input_refs):
+            task_rights = dict()
+            for op_index, (kind, right) in rights.items():
+                task_rights[op_index] = ("all", right) if kind == "all" else ("partition", right, i)
+            tasks.append(_Task(next(self._task_ids), stage, input_ref, task_rights))
+        self._execute(tasks)
+        return _Dataset(tasks, order, output_key is not None)
+
+    def _execute(self, tasks):
+        """Run the tasks on the workers, retrying failed ones and running again tasks of lost inputs"""
+        pending = deque(tasks)
+        running = dict()
+        try:
+            self._schedule(pending, running)
+        finally:
+            # replies of tasks running when the run fails aren't left for the next run
+            for worker in running:
+                try:
+                    worker.conn.recv_bytes()
+                except (EOFError, OSError):
+                    self._lose(worker)
+
+    def _schedule(self, pending, running):
+        while pending or running:
+            idle = [worker for worker in self._alive_workers() if worker not in running]
+            if not idle and not running:
+                raise RuntimeError("Cluster: no workers left")
+            deferred = list()
+            while pending and idle:
+                task = pending.popleft()
+                lost = task.lost_inputs()
+                if lost and running:
+                    # inputs are recovered when no other tasks are running
+                    deferred.append(task)
+                    continue
+                if lost:
+                    self._execute(lost)
+                    idle = [worker for worker in self._alive_workers() if worker not in running]
+                    if not idle:
+                        pending.appendleft(task)
+                        break
+                worker = next((w for w in idle if w not in task.failed_on), idle[0])
+                idle.remove(worker)
+                try:
+                    worker.conn.send_bytes(pickle.dumps(("task", task.id, task.spec()), pickle.HIGHEST_PROTOCOL))
+                except OSError:
+                    self._lose(worker)
+                    pending.appendleft(task)
+                    continue
+                running[worker] = task
+            pending.extend(deferred)
+            if not running:
+                continue
+            for conn in wait([worker.conn for worker in running]):
+                worker = next(w for w in running if w.conn is conn)
+                self._handle_reply(worker, running.pop(worker), pending)
+
+    def _handle_reply(self, worker, task, pending):
+        try:
+            reply = pickle.loads(worker.conn.recv_bytes())
+        except (EOFError, OSError):
+            self._lose(worker)
+            self._retry(task, worker, "the worker died", pending)
+            return
+        if reply[0] == "done":
+            task.worker = worker
+            task.counts = reply[2]
+        elif reply[0] == "lost":
+            for other in self._workers:
+                if other.data_address == reply[1]:
+                    self._lose(other)
+            pending.append(task)
+        else:
+            self._retry(task, worker, reply[1], pending)
+
+    def _retry(self, task, worker, error, pending):
+        task.attempts += 1
+        task.failed_on.add(worker)
+        if task.attempts > self.max_retries:
+            raise RuntimeError(f"Cluster: a task failed {task.attempts} times, the last error:\n{error}")
+        pending.append(task)
+
+    def _lose(self, worker):
+        worker.alive = False
+        worker.conn.close()
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+
+    def _collect(self, dataset):
+        """:return: rows of a dataset merged from its partitions"""
+        lost = list(set(task for task in dataset.tasks if not task.worker.alive))
+        if lost:
+            self._execute(lost)
+        partitions = [
+            merge_blocks(fetch_blocks(dataset.locations(i), self.authkey), dataset.order)
+            for i in range(dataset.partitions_count)
+        ]
+        return list(merge_blocks(partitions, dataset.order))
@@ -3,9 +3,21 @@
 This module implements an interface to perform MapReduce computations with Python streams.
 """
 
-from .node import _MapNode, _ReduceNode, _FoldNode, _SortNode, _JoinNode, _InitNode
+from .node import (
+    _MapNode, _MapBatchNode, _ReduceNode, _FoldNode, _SortNode, _JoinNode, _InitNode, _AggregateNode, _TopKNode,
+    _LimitNode
+)
+from .aggregations import Aggregation
+from .schema import Schema
+from .store import MemoryStore, DiskStore
+from .cache import ResultCache, Uncacheable, fingerprint, source_fingerprint, digest
+from .profiling import Profiler
+from .asynchronous import AsyncSource
 from collections import defaultdict
-from typing import Any, Iterable, Union, Dict, Callable, Sequence, Generator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Any, Iterable, Union, Dict, Callable, Sequence, Generator, Optional, AsyncGenerator
+import asyncio
 
 
 class ComputeGraph:
@@ -14,19 +26,33 @@ class ComputeGraph:
     Supported operations - map, reduce, sort, join, fold.
     See algorithms.py for usage examples.
     """
-    def __init__(self, source: Union[str, "ComputeGraph"]):
+    def __init__(self, source: Union[str, "ComputeGraph"], schema: Optional[Iterable[str]] = None):
         """
         :param source: keyword arg to be used in run
                        or ComputeGraph instance
+        :param schema: columns of the input table. If given, rows are stored as compact records
+                       instead of dicts. Records behave like dicts for mappers, reducers and folders,
+                       and columns out of the schema may be added to them
         """
+        self._schema = Schema(schema) if schema is not None else None
         self._main_source = source
         self._main_source_name = source if isinstance(source, str) else None
         self._nodes = list()
         self._store = False
+        self._store_type = MemoryStore
+        self._cache = None
+        self._cache_key = None
+        self._incremental = False
+        self._profile = None
         self._result = None
         self._sources = dict()
+        self._sorted_by = ()
+        self._owns_output = False
 
-    def add_map(self, mapper: Callable[[Dict[str, Any]], Generator[Dict[str, Any], None, None]]):
+    def add_map(self, mapper: Callable[[Dict[str, Any]], Generator[Dict[str, Any], None, None]],
+                workers: Optional[int] = None, batch_size: int = 1000, ordered: bool = True,
+                preserves_order: bool = False, pure: bool = False, in_place: bool = False,
+                max_in_flight: int = 64):
         """
         Add a map operation to the operations queue
         :param mapper: generator:
@@ -35,11 +61,52 @@ class ComputeGraph:
             Example:
                 def identity_mapper(row):
                     yield row
+            or async generator, e.g. for I/O-bound mappers calling services:
+                async def geocode_mapper(row):
+                    row["address"] = await geocoder.address(row["start"])
+                    yield row
+        :param workers: number of processes to run the mapper in.
+            By default the mapper is called in the current process.
+            In parallel mode the mapper should be picklable (defined at the module level)
+        :param batch_size: number of rows sent to a worker process at once
+        :param ordered: whether to keep order of rows in parallel mode and for async mappers
+        :param preserves_order: whether a sorted table stays sorted after the mapper: it changes
+            neither the sort columns nor the order of rows. Sorts of tables which are known
+            to be sorted already are skipped, tables after other mappers aren't known to be sorted
+        :param pure: whether the mapper never changes its input row, so rows are never copied for it
+        :param in_place: whether every row yielded by the mapper is yielded once and not kept by the mapper:
+            its input row, maybe changed in place, or a new row. Rows are copied before such a mapper
+            only if they may be seen by someone else (rows of a source passed to run or of a table
+            read by several graphs), and the next operations may change its rows in place.
+            Rows are copied before other mappers which aren't pure
+        :param max_in_flight: max number of rows mapped concurrently by an async mapper.
+            Async mappers run on the event loop of run_async, or on an event loop started by run
+        """
+        self._nodes.append(_MapNode(
+            self._get_last_node(), mapper=mapper, workers=workers, batch_size=batch_size, ordered=ordered,
+            preserves_order=preserves_order, pure=pure, in_place=in_place,
+            max_in_flight=max_in_flight
+        ))
+
+    def add_map_batch(self, mapper: Callable[[Dict[str, Any]], Dict[str, Any]], batch_size: int = 10000):
+        """
+        Add a vectorized map operation to the operations queue. Needs NumPy.
+        Rows are passed to the mapper in columnar batches: dicts of column names and NumPy arrays.
+        Following batch maps, sorts and aggregations take the batches without converting them to rows.
+        :param mapper: function:
+            takes one argument: batch of rows of the table
+            returns a batch of rows of a new table
+            Example:
+                def speed_mapper(batch):
+                    batch["speed"] = batch["length"] / batch["time"]
+                    return batch
+        :param batch_size: number of rows in a batch, if the input table is not columnar
         """
-        self._nodes.append(_MapNode(self._get_last_node(), mapper=mapper))
+        self._nodes.append(_MapBatchNode(self._get_last_node(), mapper=mapper, batch_size=batch_size))
 
     def add_reduce(self, reducer: Callable[[Dict[str, Any], Dict[str, Any]], Generator[Dict[str, Any], None, None]],
-                   reduce_by: Union[Iterable[str], str]):
+                   reduce_by: Union[Iterable[str], str], workers: Optional[int] = None, presorted: bool = True,
+                   memory_limit: Optional[int] = None):
         """
         Add a reduce operation to the operations queue
         :param reducer: generator:
@@ -51,19 +118,62 @@ class ComputeGraph:
                     res["count"] = len(rows)
                     yield res
         :param reduce_by: column name or tuple of columns to be used as a key
+        :param workers: number of processes to reduce in.
+            The table is hash partitioned by reduce_by columns, every partition is
+            sorted and reduced by its own process, results are merged in the order of keys.
+            A sort right before the reduce is performed by the workers as well.
+            The reducer should be picklable (defined at the module level)
+        :param presorted: whether the table is sorted by reduce_by. If not, rows are grouped
+            in a hash table instead of a sort, and groups are reduced in order of keys,
+            so the result is sorted by reduce_by all the same
+        :param memory_limit: max number of rows to be grouped in memory if the table isn't sorted,
+            groups sorted by the key are spilled to disk and merged if it is exceeded.
+            Overrides memory_limit given to run
         """
         if isinstance(reduce_by, str):
             reduce_by = (reduce_by,)
-        self._nodes.append(_ReduceNode(self._get_last_node(), reducer=reducer, reduce_by=reduce_by))
+        self._nodes.append(_ReduceNode(
+            self._get_last_node(), reducer=reducer, reduce_by=reduce_by, workers=workers, presorted=presorted,
+            memory_limit=memory_limit
+        ))
 
-    def add_sort(self, sort_by: Union[Iterable[str], str]):
+    def add_sort(self, sort_by: Union[Iterable[str], str], memory_limit: Optional[int] = None):
         """
         Add a sort operation to the operations queue
         :param sort_by: column name or tuple of columns to be used as a key
+        :param memory_limit: max number of rows to be sorted in memory,
+            the rest is sorted externally with runs spilled to temporary files.
+            Overrides memory_limit given to run
         """
         if isinstance(sort_by, str):
             sort_by = (sort_by,)
-        self._nodes.append(_SortNode(self._get_last_node(), sort_by=sort_by))
+        self._nodes.append(_SortNode(self._get_last_node(), sort_by=sort_by, memory_limit=memory_limit))
+
+    def add_top_k(self, k: int, by: Union[Iterable[str], str], per: Union[Iterable[str], str] = (),
+                  reverse: bool = False):
+        """
+        Add a top-k operation to the operations queue: select k first rows in order of by columns.
+        Only k rows (k rows of every group) are kept in memory instead of sorting the whole table
+        :param k: number of rows to be selected
+        :param by: column name or tuple of columns to select the rows by.
+            The selected rows are sorted by them
+        :param per: column name or tuple of columns of groups to select k rows from each of them.
+            By default k rows are selected from the whole table
+        :param reverse: select k last rows, sorted in descending order
+        """
+        if isinstance(by, str):
+            by = (by,)
+        if isinstance(per, str):
+            per = (per,)
+        self._nodes.append(_TopKNode(self._get_last_node(), k=k, by=tuple(by), per=tuple(per), reverse=reverse))
+
+    def add_limit(self, limit: int):
+        """
+        Add a limit operation to the operations queue: take first rows of the table.
+        The rest of the rows are not computed. A sort followed by a limit selects only the taken rows
+        :param limit: number of rows to be taken
+        """
+        self._nodes.append(_LimitNode(self._get_last_node(), limit=limit))
 
     def add_fold(self, folder: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]):
         """
@@ -77,7 +187,27 @@ class ComputeGraph:
         """
         self._nodes.append(_FoldNode(self._get_last_node(), folder=folder))
 
-    def add_join(self, on: "ComputeGraph", join_by: Union[str, Iterable[str]] = (), strategy: str = "inner"):
+    def add_aggregate(self, group_by: Union[Iterable[str], str], aggregations: Dict[str, Aggregation],
+                      sort: bool = False, memory_limit: Optional[int] = None):
+        """
+        Add an aggregation operation to the operations queue.
+        Rows are grouped in a hash table, so the input table needn't be sorted.
+        :param group_by: column name or tuple of columns to be used as a key
+        :param aggregations: dict of output column names and aggregations, see aggregations.py
+            Example:
+                {"count": aggregations.count(), "speed": aggregations.sum("length") / aggregations.sum("time")}
+        :param sort: whether to sort the result by group_by columns
+        :param memory_limit: max number of groups to be kept in memory,
+            partial aggregates are spilled to disk if it is exceeded. Overrides memory_limit given to run
+        """
+        if isinstance(group_by, str):
+            group_by = (group_by,)
+        self._nodes.append(_AggregateNode(
+            self._get_last_node(), group_by=group_by, aggregations=aggregations, sort=sort, memory_limit=memory_limit
+        ))
+
+    def add_join(self, on: "ComputeGraph", join_by: Union[str, Iterable[str]] = (), strategy: str = "inner",
+                 algorithm: str = "auto", memory_limit: Optional[int] = None):
         """
         Add a join operation to the operations queue
         :param on: ComputeGraph instance to join on
@@ -87,14 +217,49 @@ class ComputeGraph:
             "right" - right join,
             "inner" - inner join,
             "outer" - full outer join
+        :param algorithm: join algorithm, options:
+            "merge" - sort-merge join, both tables should be sorted by join_by
+            "hash" - hash join, tables may be unsorted, the table of `on` graph
+                is loaded into a hash table, so it should be the smaller one
+            "broadcast" - the table of `on` graph is small and is loaded into memory at once,
+                the other table is streamed through it keeping its order
+            "auto" - broadcast join for inner and left joins on results of a fold
+                or on small stored tables, merge join otherwise
+        :param memory_limit: max number of rows in the hash table for the hash join.
+            If it is exceeded, both tables are partitioned to disk and joined
+            partition by partition (grace hash join). For the merge join, max number
+            of rows of each side of a key kept in memory: if the right rows of a key (a hot key)
+            don't fit, the left ones are kept instead, and if they don't fit either, the right rows
+            are spilled to disk and read once for every block of left rows. The output of the merge
+            join is sorted by join_by, order of the left table within keys isn't kept.
+            Overrides memory_limit given to run
         """
         if isinstance(join_by, str):
             join_by = (join_by,)
-        self._nodes.append(_JoinNode(self._get_last_node(), strategy, on=on, join_by=join_by))
+        self._nodes.append(_JoinNode(
+            self._get_last_node(), strategy, on=on, join_by=join_by, algorithm=algorithm, memory_limit=memory_limit
+        ))
 
-    def run(self, **sources) -> Sequence[Dict[str, Any]]:
+    def run(self, memory_limit: Optional[int] = None, max_workers: Optional[int] = None,
+            store: Optional[Callable[[], Any]] = None, cache: Optional[ResultCache] = None,
+            profile: Union[bool, Profiler] = False, **sources) -> Sequence[Dict[str, Any]]:
         """
         Run calculations for the graph and all its dependencies
+        :param memory_limit: default max number of rows (groups) to be kept in memory
+            by sorts, hash joins and aggregations
+        :param max_workers: number of threads to compute dependency graphs in.
+            Independent graphs are computed concurrently, every graph is started
+            as soon as the graphs it depends on are computed. All dependency graphs
+            are stored then. By default graphs are computed one by one
+        :param store: class of stores for tables read several times: results of graphs used
+            by several graphs and sources read by several graphs. MemoryStore (default) keeps them
+            in lists, DiskStore writes them to temporary files in a compact format
+        :param cache: ResultCache to load results of graphs from instead of computing them
+            and to save computed results to. Graphs reading iterables which can't be fingerprinted
+            (other than lists and JsonLinesSource) are always computed
+        :param profile: True or a Profiler with hooks to collect statistics of every operation:
+            rows in and out, wall and CPU time in the user function and in the framework, peak memory.
+            The statistics are shown by explain after the run and passed to the hooks of the profiler
         :param sources: iterables for inputs with names due to args, given to graphs' constructors
         :return: list of rows of the result table
         """
@@ -113,39 +278,340 @@ class ComputeGraph:
         source_usages = defaultdict(int)
 
         for g in graphs:
+            g._stop_incremental()
             g._result = None
+            g._cache = cache
+            g._cache_key = None
             if g._main_source_name:
                 source_usages[g._main_source_name] += 1
 
         source_nodes = dict()
         for g in graphs:
+            g._store_type = store or MemoryStore
             g._set_source_node(sources, source_nodes, source_usages)
-            if dfs_used_graphs[g] > 1:
-                g._store = True
+            g._set_memory_limit(memory_limit)
+            # a graph read by a single consumer is streamed into it lazily
+            g._store = dfs_used_graphs[g] > 1 or (bool(max_workers) and g is not self)
+            g._plan(sources)
 
-        for g in graphs:
-            g._execute()
+        executed = graphs
+        if cache is not None:
+            executed = self._use_cache(graphs, sources, cache)
+            # results of the cache are read from disk, so the planned copies are revised
+            for g in graphs:
+                g._plan(sources)
+
+        profiler = None
+        if profile:
+            profiler = profile if isinstance(profile, Profiler) else Profiler()
+            profiler.attach(node for g in executed for node in g._profiled_nodes())
+        self._profile = profiler
+
+        try:
+            if max_workers:
+                dependencies = [g for g in executed if g is not self]
+                self._execute_concurrently(dependencies, sources, max_workers)
+                if self._result is None:
+                    self._execute()
+            else:
+                for g in executed:
+                    g._execute()
+
+            for row in self._result:
+                yield row
+        finally:
+            if profiler is not None:
+                profiler.detach(executed, dict((g, f"graph {i}") for i, g in enumerate(graphs)))
+            for g in graphs:
+                if g._store and g._result is not None:
+                    g._result.close()
+            for node in source_nodes.values():
+                node.close()
+
+    async def run_async(self, memory_limit: Optional[int] = None, max_workers: Optional[int] = None,
+                        store: Optional[Callable[[], Any]] = None, cache: Optional[ResultCache] = None,
+                        profile: Union[bool, Profiler] = False, batch_size: int = 1000,
+                        **sources) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Run the graph from a coroutine: the graph is computed in a thread of the executor of the event loop,
+        while the loop reads async sources and runs async mappers.
+        Parameters are those of run, and:
+        :param batch_size: number of rows of the result passed to the event loop at once
+        :param sources: iterables or async iterables for inputs with names due to args
+        :return: async generator of rows of the result table
+        """
+        loop = asyncio.get_running_loop()
+        sources = dict(
+            (name, AsyncSource(source, loop) if hasattr(source, "__aiter__") else source)
+            for name, source in sources.items()
+        )
+        graphs = list()
+        used_graphs = dict()
+        for source_graph in sources.values():
+            if isinstance(source_graph, ComputeGraph):
+                source_graph._topsort_dependent_graphs(graphs, used_graphs, **sources)
+        self._topsort_dependent_graphs(graphs, used_graphs, **sources)
+        map_nodes = [node for g in graphs for node in g._nodes if isinstance(node, _MapNode)]
+        for node in map_nodes:
+            node.loop = loop
+
+        rows = self.run(memory_limit=memory_limit, max_workers=max_workers, store=store, cache=cache,
+                        profile=profile, **sources)
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, list, islice(rows, batch_size))
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            await loop.run_in_executor(None, rows.close)
+            for node in map_nodes:
+                node.loop = None
+
+    def run_incremental(self, **sources) -> Sequence[Dict[str, Any]]:
+        """
+        Run the graph over rows appended to its input since the previous incremental run.
+        The first aggregation of the graph keeps its groups between the runs and merges the new rows into them,
+        so operations before it are computed for the new rows only, and operations after it for all the groups.
+        The operations before the aggregation may be maps, batch maps, sorts and inner or left joins.
+        Graphs joined to the new rows are computed once, by the first run; a stream of the input read by them
+        is stored to be read by this graph as well. A run of the graph
+        with the run method drops the kept groups.
+        :param sources: the first run takes iterables for all inputs of the graph and the graphs it joins,
+            the next ones take iterables of new rows for the input of the graph
+        :return: rows of the result table for all the rows given to incremental runs
+        """
+        if not self._incremental:
+            aggregate = self._check_incremental()
+            joined_graphs = list()
+            for node in self._nodes[:self._nodes.index(aggregate)]:
+                if isinstance(node, _JoinNode):
+                    node.on._topsort_dependent_graphs(joined_graphs, dict())
+            # a stream of the input read by the joined graphs is stored to be read by this graph too
+            source = sources.get(self._main_source_name)
+            if source is not None and iter(source) is source and any(
+                    g._main_source_name == self._main_source_name for g in joined_graphs):
+                sources = dict(sources, **{self._main_source_name: MemoryStore().write_all(source)})
+            for node in self._nodes[:self._nodes.index(aggregate)]:
+                if isinstance(node, _JoinNode):
+                    node.on._result = MemoryStore().write_all(node.on.run(**sources))
+                    node.on._store = True
+                    node.incremental = True
+            aggregate.state = dict()
+            self._incremental = True
 
+        self._set_source_node(sources, dict(), defaultdict(int))
+        self._set_memory_limit(None)
+        self._store = False
+        self._cache_key = None
+        self._plan(sources)
+        self._execute()
         for row in self._result:
             yield row
 
+    def _check_incremental(self):
+        """:return: the first aggregation of the graph, which keeps groups between incremental runs"""
+        if not self._main_source_name:
+            raise RuntimeError("Incremental run: the graph should read an input given to run")
+        for node in self._nodes:
+            if isinstance(node, _AggregateNode):
+                return node
+            if isinstance(node, _JoinNode) and node.strategy not in ("inner", "left"):
+                raise RuntimeError(f"Incremental run: {node.strategy} join can't be computed for new rows only")
+            if not isinstance(node, (_MapNode, _MapBatchNode, _SortNode, _JoinNode)):
+                raise RuntimeError(f"Incremental run: {node.explain(dict())} can't be computed for new rows only")
+        raise RuntimeError("Incremental run: the graph has no aggregation")
+
+    def _stop_incremental(self):
+        self._incremental = False
+        for node in self._nodes:
+            if isinstance(node, _AggregateNode):
+                node.state = None
+            elif isinstance(node, _JoinNode):
+                node.incremental = False
+
+    @staticmethod
+    def _execute_concurrently(graphs, sources, max_workers):
+        # results of the other graphs are ready
+        dependencies = dict((g, g._get_dependencies(sources) & set(graphs)) for g in graphs)
+        pending = list(graphs)
+        running = dict()
+        done = set()
+        with ThreadPoolExecutor(max_workers) as pool:
+            while pending or running:
+                for g in list(pending):
+                    if dependencies[g] <= done:
+                        pending.remove(g)
+                        running[pool.submit(g._execute)] = g
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
+
+    def _use_cache(self, graphs, sources, cache):
+        """
+        Load results of graphs from the cache, mark the others to save their results to it
+        :return: graphs to be executed, the ones which results are needed and are not in the cache
+        """
+        keys = dict()
+        for g in graphs:
+            try:
+                key = g._fingerprint(sources, keys)
+            except Uncacheable:
+                continue
+            g._result = cache.get(key)
+            g._cache_key = key
+            g._store = True
+            g._store_type = DiskStore
+
+        needed = set()
+        pending = [self]
+        while pending:
+            g = pending.pop()
+            if g not in needed and g._result is None:
+                needed.add(g)
+                pending.extend(g._get_dependencies(sources))
+        return [g for g in graphs if g in needed]
+
+    def _fingerprint(self, sources, keys):
+        """
+        Fingerprint of the graph: its operations, its sources and the graphs it reads
+        :param keys: dict of fingerprints of graphs and sources computed before
+        :raise Uncacheable: if the graph reads a source which can't be fingerprinted
+        """
+        key = keys.get(self)
+        if key is not None:
+            return key
+        source = sources.get(self._main_source_name, self._main_source)
+        if isinstance(source, ComputeGraph):
+            source_key = source._fingerprint(sources, keys)
+        else:
+            if self._main_source_name not in keys:
+                keys[self._main_source_name] = source_fingerprint(source)
+            source_key = keys[self._main_source_name]
+            if source_key is None:
+                raise Uncacheable(self._main_source_name)
+
+        def graph_key(graph):
+            return graph._fingerprint(sources, keys)
+
+        nodes = [
+            (type(node).__name__, fingerprint(node.fingerprint_params(), graph_key))
+            for node in self._nodes if not isinstance(node, _InitNode)
+        ]
+        key = keys[self] = digest((source_key, self._schema.columns if self._schema else None, nodes))
+        return key
+
+    def _get_dependencies(self, sources):
+        """:return: set of graphs, which results are read by this graph"""
+        dependencies = set(node.on for node in self._nodes if isinstance(node, _JoinNode))
+        source = sources.get(self._main_source_name, self._main_source)
+        if isinstance(source, ComputeGraph):
+            dependencies.add(source)
+        return dependencies
+
+    def explain(self) -> str:
+        """
+        Describe the execution plan: all the graphs needed to run this one, in order of execution,
+        with their operations. Sorts removed or weakened by the planner are marked.
+        Statistics of operations are added after a run with profile
+        :return: text of the plan
+        """
+        graphs = list()
+        self._topsort_dependent_graphs(graphs, dict())
+        names = dict((g, f"graph {i}") for i, g in enumerate(graphs))
+
+        lines = list()
+        for g in graphs:
+            g._plan(dict())
+            source = names[g._main_source] if isinstance(g._main_source, ComputeGraph) else repr(g._main_source)
+            lines.append(f"{names[g]} (source: {source}):")
+            for node in g._nodes:
+                if isinstance(node, _InitNode):
+                    continue
+                lines.append(f"    {node.explain(names)}")
+                stats = self._profile.stats.get(node) if self._profile is not None else None
+                if stats is not None:
+                    lines.append(f"        {stats}")
+        return "\n".join(lines)
+
+    def _plan(self, sources):
+        """
+        Track order of the tables through the graph and drop needless sorts,
+        track ownership of rows and drop needless copies, fuse chains of maps
+        """
+        source = sources.get(self._main_source_name, self._main_source)
+        order = source._sorted_by if isinstance(source, ComputeGraph) else ()
+        # rows of a graph given by name may be read by other graphs too
+        owned = self._main_source is source and isinstance(source, ComputeGraph) and source._output_owned()
+        for node in self._nodes:
+            node.schema = self._schema
+            order = node.plan(order)
+            owned = node.plan_copies(owned)
+        self._sorted_by = order
+        self._owns_output = owned
+        self._fuse_maps()
+
+    def _fuse_maps(self):
+        """Let the last map of every chain of maps, or a fold after them, run the whole chain"""
+        chain = list()
+        for node in self._nodes + [None]:
+            if isinstance(node, _MapNode):
+                node.fused = 0
+                if node.fusable():
+                    # a new chain is started after the longest one
+                    if len(chain) == _MapNode.FUSED_LIMIT:
+                        chain[-1].fused = len(chain) - 1
+                        chain = list()
+                    chain.append(node)
+                    continue
+            if isinstance(node, _FoldNode):
+                node.fused = len(chain)
+            elif len(chain) > 1:
+                chain[-1].fused = len(chain) - 1
+            chain = list()
+
+    def _profiled_nodes(self):
+        """:return: nodes of the graph with the input nodes it reads the source through"""
+        nodes = list(self._nodes)
+        node = self._nodes[0]
+        while isinstance(node.source, _InitNode):
+            node = node.source
+            nodes.append(node)
+        return nodes
+
+    def _output_owned(self):
+        """:return: whether rows read from the graph are not referenced by anyone else"""
+        if self._store:
+            return not self._store_type.shares_rows
+        return self._owns_output
+
     def _set_source_node(self, sources, nodes, usages):
         if self._main_source_name:
             next_node = nodes.get(self._main_source_name)
             if not next_node:
                 store_input_stream = (usages[self._main_source_name] > 1)
                 next_node = _InitNode(
-                    sources[self._main_source_name], store_stream=store_input_stream
+                    sources[self._main_source_name], store_stream=store_input_stream, schema=self._schema,
+                    store_type=self._store_type
                 )
                 nodes[self._main_source_name] = next_node
+            elif self._schema and next_node.schema is not self._schema:
+                next_node = _InitNode(next_node, store_stream=False, schema=self._schema)
         else:
-            next_node = _InitNode(self._main_source, store_stream=False)
+            next_node = _InitNode(self._main_source, store_stream=False, schema=self._schema)
 
         if not self._nodes:
             self._nodes.append(next_node)
         else:
             self._nodes[0].set_source(next_node)
 
+    def _set_memory_limit(self, memory_limit):
+        for node in self._nodes:
+            if isinstance(node, (_SortNode, _JoinNode, _AggregateNode, _ReduceNode)):
+                node.default_memory_limit = memory_limit
+
     def _topsort_dependent_graphs(self, answer, used, **sources):
         used[self] = 1
         if self._nodes:
@@ -172,11 +638,10 @@ class ComputeGraph:
         answer.append(self)
 
     def _execute(self):
-        self._store = True
-        if self._store:
-            self._result = list()
-            for row in self._get_last_node():
-                self._result.append(row)
+        if self._cache_key is not None:
+            self._result = self._cache.put(self._cache_key, self._get_last_node())
+        elif self._store:
+            self._result = self._store_type().write_all(self._get_last_node())
         else:
             self._result = iter(self._get_last_node())
 
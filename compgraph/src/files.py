@@ -0,0 +1,119 @@
+"""
+Sources and sinks of newline-delimited JSON files (one row per line).
+
+    graph.run(docs=JsonLinesSource("docs.jsonl", columns=("doc_id", "text")))
+    JsonLinesSink("result.jsonl").write_all(graph.run(...))
+
+A source memory-maps its file and splits it into chunks of lines, which
+are decoded all at once, optionally in a pool of processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import mmap
+
+from .parallel import batches, pool_map
+
+
+def file_chunks(data, chunk_size):
+    """:return: (start, end) offsets of chunks of data ending with new lines"""
+    chunks = list()
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start + chunk_size)
+        end = len(data) if end == -1 else end + 1
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def decode_lines(text, columns=None):
+    """Decode rows of JSON lines, keeping only the columns if given"""
+    lines = [line for line in text.split("\n") if line and not line.isspace()]
+    # one call of the decoder for all the lines is much faster than one for every line
+    rows = json.loads("[" + ",".join(lines) + "]")
+    if columns is None:
+        return rows
+    return [dict((col, row[col]) for col in columns if col in row) for row in rows]
+
+
+def decode_chunk(path, start, end, columns=None):
+    """Decode rows of a chunk of a file in a worker process"""
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return decode_lines(data[start:end].decode("utf-8"), columns)
+
+
+class JsonLinesSource:
+    """
+    Rows of a newline-delimited JSON file. May be passed to ComputeGraph.run as a source,
+    the file is read anew every time the source is iterated.
+    """
+    def __init__(self, path, columns=None, workers=None, chunk_size=1 << 22):
+        """
+        :param columns: columns to be kept in the rows, all columns by default
+        :param workers: number of processes to decode chunks of the file in, None to decode in place
+        :param chunk_size: approximate size of chunks of the file in bytes
+        """
+        self.path = path
+        self.columns = tuple(columns) if columns is not None else None
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def fingerprint(self):
+        """:return: hash of the content of the file, for the cache of results"""
+        hash = hashlib.sha256(repr(self.columns).encode())
+        with open(self.path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                hash.update(block)
+        return hash.hexdigest()
+
+    def __iter__(self):
+        with open(self.path, "rb") as file:
+            # an empty file can't be mapped
+            if not file.seek(0, 2):
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                chunks = file_chunks(data, self.chunk_size)
+                if not self.workers:
+                    for start, end in chunks:
+                        for row in decode_lines(data[start:end].decode("utf-8"), self.columns):
+                            yield row
+                    return
+        with ProcessPoolExecutor(self.workers) as pool:
+            tasks = ((self.path, start, end, self.columns) for start, end in chunks)
+            for rows in pool_map(pool, decode_chunk, tasks, 2 * self.workers):
+                for row in rows:
+                    yield row
+
+
+class JsonLinesSink:
+    """Writer of rows to a newline-delimited JSON file"""
+    def __init__(self, file, batch_size=10000):
+        """
+        :param file: path of the file or a text file object, e.g. sys.stdout
+        :param batch_size: number of rows encoded and written at once
+        """
+        self.file = file
+        self.batch_size = batch_size
+        # records of schemas are written as dicts
+        self.encoder = json.JSONEncoder(default=dict)
+
+    def write_all(self, rows):
+        """
+        Write all the rows
+        :return: number of the rows
+        """
+        if isinstance(self.file, str):
+            with open(self.file, "w", buffering=1 << 20) as file:
+                return self.write_to(file, rows)
+        return self.write_to(self.file, rows)
+
+    def write_to(self, file, rows):
+        count = 0
+        for batch in batches(rows, self.batch_size):
+            file.write("\n".join(map(self.encoder.encode, batch)) + "\n")
+            count += len(batch)
+        file.flush()
+        return count
@@ -0,0 +1,32 @@
+"""
+Keys of rows for sorts, reduces, joins and aggregations.
+
+Columns of a key are compiled once into a key function, which returns
+a tuple of values of the columns for a row. Key tuples are hashable and
+are compared directly, nothing else is built for a row to get its key.
+"""
+
+from operator import itemgetter
+
+
+def _empty_key(row):
+    return ()
+
+
+def key_getter(columns, schema=None):
+    """
+    Compile columns into a key function returning a tuple of values of the columns
+    :param schema: schema of the rows, values of its records are taken from their slots
+    """
+    columns = tuple(columns)
+    if not columns:
+        return _empty_key
+    getter = schema.getter(columns) if schema is not None else itemgetter(*columns)
+    if len(columns) > 1:
+        return getter
+    return lambda row: (getter(row),)
+
+
+def key_dict(columns, key):
+    """Dict of the columns and values of a key, as passed to reducers"""
+    return dict(zip(columns, key))
@@ -1,14 +1,73 @@
 from operator import itemgetter
-from itertools import groupby
+from threading import Lock
+from itertools import groupby, chain, islice
+from collections import defaultdict
+import heapq
+import inspect
 
+from .spill import spill, hash_partition, _SpillFile
+from .parallel import parallel_map, parallel_sort_reduce, parallel_map_aggregate
+from .keys import key_getter, key_dict
+from .aggregations import merge_states
+from .schema import copy_row
+from .store import MemoryStore
+from .profiling import profiled_iteration, JoinKeyStats
+from .asynchronous import async_map
+from .batch import (
+    np, require_numpy, source_batches, rows_to_batch, batch_to_rows, batch_length, concat_batches, take,
+    group_indexes, join_batches
+)
 
-class dictitemgetter:
-    """Replica of itemgetter, always returning iterable from iterable"""
-    def __init__(self, *args):
-        self.keys = args
 
-    def __call__(self, row):
-        return [row[col] for col in self.keys]
+def is_prefix(prefix, columns):
+    return tuple(columns[:len(prefix)]) == tuple(prefix)
+
+
+def common_prefix(first, second):
+    prefix = list()
+    for col1, col2 in zip(first, second):
+        if col1 != col2:
+            break
+        prefix.append(col1)
+    return tuple(prefix)
+
+
+def function_name(function):
+    return getattr(function, "__name__", repr(function))
+
+
+_fused_maps = dict()
+
+
+def fused_map(copies):
+    """
+    Generator function fused(rows, copy_row, mapper0, mapper1, ...) running the mappers one after
+    another in nested loops, instead of a generator of a node for every mapper
+    :param copies: whether every mapper takes a copy of its input row
+    """
+    function = _fused_maps.get(copies)
+    if function is None:
+        args = "".join(f", mapper{i}" for i in range(len(copies)))
+        lines = [f"def fused(rows, copy_row{args}):", "    for row0 in rows:"]
+        for i, copy in enumerate(copies):
+            arg = f"copy_row(row{i})" if copy else f"row{i}"
+            lines.append(f"{'    ' * (i + 2)}for row{i + 1} in mapper{i}({arg}):")
+        lines.append(f"{'    ' * (len(copies) + 2)}yield row{len(copies)}")
+        namespace = dict()
+        exec("\n".join(lines), namespace)
+        function = _fused_maps[copies] = namespace["fused"]
+    return function
+
+
+def fused_rows(node, count):
+    """Rows of a chain of count maps ending with the node, run by one fused generator"""
+    nodes = [node]
+    # in the tasks of a cluster a chain may start with the input of the task
+    while len(nodes) < count and isinstance(nodes[-1].source, _MapNode):
+        nodes.append(nodes[-1].source)
+    nodes.reverse()
+    fused = fused_map(tuple(n.copy_input for n in nodes))
+    return fused(nodes[0].source, copy_row, *(n.mapper for n in nodes))
 
 
 def merge_dicts(left, right, ignored_keys=()):
@@ -20,101 +79,705 @@ def merge_dicts(left, right, ignored_keys=()):
 
 
 class _Node:
+    schema = None
+    # copies of rows are made only if the rows may be seen by someone else
+    eliminate_copies = True
+    # Profiler collecting statistics of the node in a profiled run
+    profiler = None
+    # attributes which don't change the result of the node
+    RUNTIME_ATTRIBUTES = {
+        "source", "schema", "lock", "stored", "store_type", "memory_limit", "default_memory_limit",
+        "workers", "batch_size", "copy_input", "reuse_left_rows", "state", "incremental", "profiler",
+        "max_in_flight", "loop", "key_stats", "fused"
+    }
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # iteration over rows and batches of every node is measured when it's profiled
+        if "__iter__" in vars(cls):
+            cls.__iter__ = profiled_iteration(cls.__iter__)
+        if "iter_batches" in vars(cls):
+            cls.iter_batches = profiled_iteration(cls.iter_batches, batches=True)
+
     def __init__(self, source):
         """
         :param source: iterable or CompGraph
         """
         self.source = source
 
+    def key_getter(self, columns):
+        """Key function for the columns, fast for records of the schema of the graph"""
+        return key_getter(columns, self.schema)
+
     def set_source(self, source):
         self.source = source
 
+    def plan(self, input_order):
+        """
+        Prepare the node for execution
+        :param input_order: tuple of columns the input table is known to be sorted by
+        :return: tuple of columns the output table is sorted by
+        """
+        return ()
+
+    def fingerprint_params(self):
+        """:return: dict of parameters of the node which define its result, for the cache of results"""
+        return dict((name, value) for name, value in vars(self).items() if name not in self.RUNTIME_ATTRIBUTES)
+
+    def plan_copies(self, input_owned):
+        """
+        Decide whether the node should copy rows it changes
+        :param input_owned: whether input rows are not referenced by anyone else, so they may be changed in place
+        :return: whether output rows are not referenced by anyone else
+        """
+        return input_owned
+
+    def explain(self, graph_names):
+        """:return: description of the node for ComputeGraph.explain"""
+        return type(self).__name__.strip("_").replace("Node", "")
+
 
 class _InitNode(_Node):
-    def __init__(self, source, store_stream):
+    def __init__(self, source, store_stream, schema=None, store_type=MemoryStore):
+        """
+        :param schema: Schema to pack rows into records of, None to keep rows as they are
+        :param store_type: class of the store for the stream read several times
+        """
         super(_InitNode, self).__init__(source)
         self.store_stream = store_stream
+        self.store_type = store_type
+        self.stored = None
+        self.lock = Lock()
+        self.schema = schema
 
     def __iter__(self):
         return self.run_init()
 
+    def plan(self, input_order):
+        return input_order
+
+    def plan_copies(self, input_owned):
+        if self.store_stream:
+            return not self.store_type.shares_rows
+        return input_owned
+
     def run_init(self):
         if not self.source:
             raise RuntimeError
         if self.store_stream:
-            self.source = list(self.source)
-        for row in self.source:
-            yield row
+            # the stream may be read by graphs running in different threads
+            with self.lock:
+                if self.stored is None:
+                    self.stored = self.store_type().write_all(self.pack(self.source))
+            # rows read back from a store on disk are packed again
+            for row in self.pack(self.stored):
+                yield row
+        else:
+            for row in self.pack(self.source):
+                yield row
+
+    def pack(self, rows):
+        if self.schema is None:
+            return rows
+        return map(self.schema.record, rows)
+
+    def close(self):
+        if self.stored is not None:
+            self.stored.close()
+            self.stored = None
 
 
 class _MapNode(_Node):
-    def __init__(self, source, mapper):
+    # chains of maps run in place are run by one generator
+    fuse = True
+    # max number of maps run by one fused generator, Python limits the nesting of its loops
+    FUSED_LIMIT = 16
+
+    def __init__(self, source, mapper, workers=None, batch_size=1000, ordered=True, preserves_order=False,
+                 pure=False, in_place=False, max_in_flight=64):
+        """
+        :param workers: number of processes to run the mapper in, None to run in place
+        :param batch_size: number of rows sent to a worker at once
+        :param ordered: keep order of the input table in parallel and async modes
+        :param preserves_order: whether the mapper keeps the table sorted
+        :param pure: whether the mapper doesn't change its input rows
+        :param in_place: whether every row the mapper yields is yielded once and not kept by it,
+                         e.g. its input row changed in place or a new row
+        :param max_in_flight: max number of rows mapped at once by an async mapper
+        """
         super(_MapNode, self).__init__(source)
         self.mapper = mapper
+        self.workers = workers
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.preserves_order = preserves_order
+        self.pure = pure
+        self.in_place = in_place
+        self.copy_input = not pure
+        self.asynchronous = inspect.isasyncgenfunction(mapper)
+        self.max_in_flight = max_in_flight
+        # event loop of run_async to run an async mapper on, a loop of the node is started by default
+        self.loop = None
+        # number of maps before this one, which are run together with it by its generator
+        self.fused = 0
+        if self.asynchronous and workers:
+            raise RuntimeError("Map: async mappers can't be run in worker processes")
+
+    def fusable(self):
+        """Whether the mapper runs in place, so it may be fused with the maps next to it"""
+        return self.fuse and not self.workers and not self.asynchronous
+
+    def plan(self, input_order):
+        if self.preserves_order and (self.ordered or not (self.workers or self.asynchronous)):
+            return input_order
+        return ()
+
+    def plan_copies(self, input_owned):
+        # a mapper may change rows it gets in place only if it's declared not to yield or keep a row twice
+        self.copy_input = not self.pure and not (self.in_place and input_owned and self.eliminate_copies)
+        if self.pure:
+            # a pure mapper may yield its input rows
+            return input_owned
+        # other mappers may yield the same row several times unless they are declared in place
+        return self.in_place
+
+    def explain(self, graph_names):
+        if self.asynchronous:
+            return f"Map({function_name(self.mapper)}, async, {self.max_in_flight} in flight)"
+        description = f"Map({function_name(self.mapper)})"
+        if self.fused:
+            description += f" - fused with {self.fused} maps before"
+        return description
 
     def __iter__(self):
+        if self.workers:
+            return self.run_parallel_map()
+        if self.asynchronous:
+            return self.run_async_map()
+        # maps of a profiled run are measured one by one
+        if self.fused and self.profiler is None:
+            return fused_rows(self, self.fused + 1)
         return self.run_map()
 
     def run_map(self):
+        if not self.copy_input:
+            for row in self.source:
+                for res_row in self.mapper(row):
+                    yield res_row
+            return
         for row in self.source:
-            for res_row in self.mapper(dict(row)):
+            for res_row in self.mapper(copy_row(row)):
                 yield res_row
 
+    def run_parallel_map(self):
+        # rows are pickled on their way to workers, so they need no copying
+        for res_row in parallel_map(self.mapper, self.source, self.workers, self.batch_size, self.ordered):
+            yield res_row
+
+    def run_async_map(self):
+        rows = map(copy_row, self.source) if self.copy_input else self.source
+        for res_row in async_map(self.mapper, rows, self.max_in_flight, self.ordered, self.loop):
+            yield res_row
+
+
+class _MapBatchNode(_Node):
+    produces_batches = True
+
+    def __init__(self, source, mapper, batch_size=10000):
+        """
+        :param mapper: function taking a columnar batch and returning a new one
+        :param batch_size: number of rows in a batch built from a row-wise input
+        """
+        require_numpy()
+        super(_MapBatchNode, self).__init__(source)
+        self.mapper = mapper
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        return self.run_map_batch()
+
+    def plan(self, input_order):
+        return input_order
+
+    def plan_copies(self, input_owned):
+        return True
+
+    def explain(self, graph_names):
+        return f"MapBatch({function_name(self.mapper)})"
+
+    def iter_batches(self):
+        for batch in source_batches(self.source, self.batch_size):
+            res_batch = self.mapper(batch)
+            if batch_length(res_batch):
+                yield res_batch
+
+    def run_map_batch(self):
+        for batch in self.iter_batches():
+            for row in batch_to_rows(batch):
+                yield row
+
 
 class _ReduceNode(_Node):
-    def __init__(self, source, reducer, reduce_by):
+    def __init__(self, source, reducer, reduce_by, workers=None, presorted=True, memory_limit=None):
+        """
+        :param workers: number of processes to sort and reduce hash partitions of the table in,
+                        None to reduce in place
+        :param presorted: whether the input table is sorted by reduce_by,
+                          otherwise rows are grouped in a hash table
+        :param memory_limit: max number of rows to be grouped in memory,
+                             groups sorted by the key are spilled to disk if it is exceeded
+        """
         super(_ReduceNode, self).__init__(source)
         self.reducer = reducer
         self.reduce_by = reduce_by
+        self.workers = workers
+        self.presorted = presorted
+        self.memory_limit = memory_limit
+        self.default_memory_limit = None
+        # rows of a key come together, as the planner has found
+        self.grouped = presorted
 
     def __iter__(self):
+        if self.workers:
+            return self.run_parallel_reduce()
+        if not self.grouped:
+            return self.run_hash_reduce()
         return self.run_reduce()
 
+    def plan(self, input_order):
+        self.grouped = self.presorted or is_prefix(self.reduce_by, input_order)
+        return tuple(self.reduce_by)
+
+    def plan_copies(self, input_owned):
+        # a reducer may yield the same row several times
+        return False
+
+    def explain(self, graph_names):
+        description = f"Reduce({function_name(self.reducer)}, by {', '.join(self.reduce_by)})"
+        if not self.grouped and not self.workers:
+            description += " - hash grouping"
+        return description
+
     def run_reduce(self):
         last_key = None
-        igetter = dictitemgetter(*self.reduce_by)
-        for key, rows in groupby(self.source, lambda row: dict((k, row[k]) for k in self.reduce_by)):
-            if last_key is None or igetter(last_key) < igetter(key):
-                for row in self.reducer(key, rows):
+        for key, rows in groupby(self.source, self.key_getter(self.reduce_by)):
+            if last_key is None or last_key < key:
+                for row in self.reducer(key_dict(self.reduce_by, key), rows):
                     yield row
                 last_key = key
             else:
                 raise RuntimeError("Reduce: input table is not sorted")
 
+    def run_hash_reduce(self):
+        """
+        Group rows of the unsorted table in a hash table and reduce the groups in order of keys.
+        If there are more than memory_limit rows, groups sorted by the key are spilled to disk and merged
+        """
+        memory_limit = self.memory_limit or self.default_memory_limit
+        key = self.key_getter(self.reduce_by)
+        groups = dict()
+        rows_count = 0
+        runs = list()
+        try:
+            for row in self.source:
+                row_key = key(row)
+                group = groups.get(row_key)
+                if group is None:
+                    groups[row_key] = [row]
+                else:
+                    group.append(row)
+                rows_count += 1
+                if memory_limit and rows_count >= memory_limit:
+                    runs.append(spill(self.sorted_groups(groups)))
+                    groups = dict()
+                    rows_count = 0
+            if not runs:
+                for group_key in sorted(groups):
+                    for row in self.reducer(key_dict(self.reduce_by, group_key), iter(groups.pop(group_key))):
+                        yield row
+                return
+            # heapq.merge prefers earlier runs on ties, so rows of a key stay in the input order
+            rows = heapq.merge(*runs, self.sorted_groups(groups), key=key)
+            for group_key, rows_for_key in groupby(rows, key):
+                for row in self.reducer(key_dict(self.reduce_by, group_key), rows_for_key):
+                    yield row
+        finally:
+            for run in runs:
+                run.close()
+
+    @staticmethod
+    def sorted_groups(groups):
+        """Rows of the groups in order of their keys, the groups are emptied"""
+        for group_key in sorted(groups):
+            for row in groups.pop(group_key):
+                yield row
+
+    def run_parallel_reduce(self):
+        sort_by = tuple(self.reduce_by)
+        source = self.source
+        if isinstance(source, _SortNode):
+            # the preceding sort is done by workers for each partition
+            sort_by += tuple(col for col in source.sort_by if col not in self.reduce_by)
+            source = source.source
+        for row in parallel_sort_reduce(self.reducer, self.reduce_by, sort_by, source, self.workers):
+            yield row
+
 
 class _SortNode(_Node):
-    def __init__(self, source, sort_by):
+    def __init__(self, source, sort_by, memory_limit=None):
+        """
+        :param memory_limit: max number of rows to be kept in memory,
+                             sorted runs exceeding it are spilled to disk
+        """
         super(_SortNode, self).__init__(source)
         self.sort_by = sort_by
+        self.memory_limit = memory_limit
+        self.default_memory_limit = None
+        self.skip = False
+        self.presorted_by = ()
+        # number of rows taken by a following limit, only they are selected then
+        self.limit = None
 
     def __iter__(self):
         return self.run_sort()
 
+    def plan(self, input_order):
+        # the sort is not needed if the input is sorted by the same columns,
+        # and it is done group by group if the input is sorted by a prefix of them
+        self.skip = is_prefix(self.sort_by, input_order)
+        self.presorted_by = () if self.skip else common_prefix(self.sort_by, input_order)
+        self.limit = None
+        return input_order if self.skip else tuple(self.sort_by)
+
+    def explain(self, graph_names):
+        description = f"Sort({', '.join(self.sort_by)})"
+        if self.skip:
+            description += " - removed, input is already sorted"
+        elif self.presorted_by:
+            description += f" - within groups of ({', '.join(self.presorted_by)}), input is sorted by them"
+        elif self.limit is not None:
+            description += f" - top {self.limit} rows, followed by a limit"
+        return description
+
+    @property
+    def produces_batches(self):
+        memory_limit = self.memory_limit or self.default_memory_limit
+        return getattr(self.source, "produces_batches", False) and not self.presorted_by and not memory_limit
+
+    def iter_batches(self):
+        if self.skip:
+            for batch in self.source.iter_batches():
+                yield batch
+            return
+        batch = concat_batches(self.source.iter_batches())
+        if batch_length(batch):
+            # lexsort is stable and sorts by the last key first
+            yield take(batch, np.lexsort([batch[col] for col in reversed(self.sort_by)]))
+
     def run_sort(self):
-        for row in sorted(self.source, key=itemgetter(*self.sort_by)):
-            yield row
+        memory_limit = self.memory_limit or self.default_memory_limit
+        if self.produces_batches:
+            for batch in self.iter_batches():
+                for row in batch_to_rows(batch):
+                    yield row
+        elif self.skip:
+            for row in self.source:
+                yield row
+        elif self.presorted_by:
+            key = self.key_getter(self.sort_by[len(self.presorted_by):])
+            for _, rows in groupby(self.source, self.key_getter(self.presorted_by)):
+                for row in self.sort_rows(rows, key, memory_limit):
+                    yield row
+        elif self.limit is not None and not (memory_limit and self.limit > memory_limit):
+            for row in heapq.nsmallest(self.limit, self.source, key=self.key_getter(self.sort_by)):
+                yield row
+        else:
+            for row in self.sort_rows(self.source, self.key_getter(self.sort_by), memory_limit):
+                yield row
+
+    @staticmethod
+    def sort_rows(rows, key, memory_limit):
+        if not memory_limit:
+            for row in sorted(rows, key=key):
+                yield row
+            return
+
+        runs = list()
+        try:
+            buffer = list()
+            for row in rows:
+                buffer.append(row)
+                if len(buffer) >= memory_limit:
+                    buffer.sort(key=key)
+                    runs.append(spill(buffer))
+                    buffer = list()
+            buffer.sort(key=key)
+            # heapq.merge prefers earlier iterables on ties, so the sort stays stable
+            for row in heapq.merge(*runs, buffer, key=key):
+                yield row
+        finally:
+            for run in runs:
+                run.close()
 
 
 class _FoldNode(_Node):
     def __init__(self, source, folder):
         super(_FoldNode, self).__init__(source)
         self.folder = folder
+        # number of maps before the fold, which are run together with it by its generator
+        self.fused = 0
 
     def __iter__(self):
         return self.run_fold()
 
+    def explain(self, graph_names):
+        description = f"Fold({function_name(self.folder)})"
+        if self.fused:
+            description += f" - fused with {self.fused} maps before"
+        return description
+
     def run_fold(self):
+        if self.fused and self.profiler is None and isinstance(self.source, _MapNode):
+            yield self.folder(fused_rows(self.source, self.fused))
+            return
         yield self.folder(iter(self.source))
 
 
+class _TopKNode(_Node):
+    def __init__(self, source, k, by, per=(), reverse=False):
+        """
+        :param k: number of rows to be selected from the table or from every group
+        :param by: columns to select the rows by, the first rows in their sort order are taken
+        :param per: columns of groups to select the rows in, empty for the whole table
+        :param reverse: take the last rows instead
+        """
+        super(_TopKNode, self).__init__(source)
+        self.k = k
+        self.by = by
+        self.per = per
+        self.reverse = reverse
+        self.presorted = False
+
+    def __iter__(self):
+        return self.run_top_k()
+
+    def plan(self, input_order):
+        # groups are selected one by one if the input is sorted by them, otherwise all at once
+        self.presorted = is_prefix(self.per, input_order)
+        return tuple(self.per) if self.reverse else tuple(self.per) + tuple(self.by)
+
+    def explain(self, graph_names):
+        description = f"TopK({self.k}, by ({', '.join(self.by)})"
+        if self.per:
+            description += f", per ({', '.join(self.per)})"
+        return description + (", reverse)" if self.reverse else ")")
+
+    def run_top_k(self):
+        if self.k <= 0:
+            return
+        # heapq.nsmallest/nlargest keep at most k rows in a heap and are stable
+        select = heapq.nlargest if self.reverse else heapq.nsmallest
+        key = self.key_getter(self.by)
+        if not self.per:
+            for row in select(self.k, self.source, key=key):
+                yield row
+        elif self.presorted:
+            for _, rows in groupby(self.source, self.key_getter(self.per)):
+                for row in select(self.k, rows, key=key):
+                    yield row
+        else:
+            group_key = self.key_getter(self.per)
+            groups = defaultdict(list)
+            for row in self.source:
+                rows = groups[group_key(row)]
+                rows.append(row)
+                # candidates of a group are trimmed back to k rows when they are twice as many
+                if len(rows) >= 2 * self.k:
+                    rows[:] = select(self.k, rows, key=key)
+            for _, rows in sorted(groups.items(), key=itemgetter(0)):
+                for row in select(self.k, rows, key=key):
+                    yield row
+
+
+class _LimitNode(_Node):
+    def __init__(self, source, limit):
+        super(_LimitNode, self).__init__(source)
+        self.limit = limit
+
+    def __iter__(self):
+        return self.run_limit()
+
+    def plan(self, input_order):
+        # a sort followed by a limit selects only the rows taken by the limit
+        if isinstance(self.source, _SortNode) and not self.source.skip:
+            self.source.limit = self.limit
+        return input_order
+
+    def explain(self, graph_names):
+        return f"Limit({self.limit})"
+
+    def run_limit(self):
+        # rows after the limit are not pulled from the source
+        for row in islice(self.source, self.limit):
+            yield row
+
+
+class _AggregateNode(_Node):
+    SPILL_PARTITIONS = 16
+
+    def __init__(self, source, group_by, aggregations, sort=False, memory_limit=None):
+        """
+        :param aggregations: dict of output column names and Aggregation instances
+        :param sort: whether to sort the output by group_by columns
+        :param memory_limit: max number of groups to be kept in memory,
+                             partial states of groups are spilled to disk if it is exceeded
+        """
+        super(_AggregateNode, self).__init__(source)
+        self.group_by = group_by
+        self.aggregations = aggregations
+        self.sort = sort
+        self.memory_limit = memory_limit
+        self.default_memory_limit = None
+        # groups kept between incremental runs, None if the node is not run incrementally
+        self.state = None
+
+    def __iter__(self):
+        return self.run_aggregate()
+
+    def plan(self, input_order):
+        return tuple(self.group_by) if self.sort else ()
+
+    def plan_copies(self, input_owned):
+        return True
+
+    def explain(self, graph_names):
+        return f"Aggregate({', '.join(self.aggregations)}, by {', '.join(self.group_by)})"
+
+    def run_aggregate(self):
+        aggregations = list(self.aggregations.values())
+        memory_limit = self.memory_limit or self.default_memory_limit
+        groups = dict()
+        partitions = None
+        if self.state is not None:
+            # new rows are merged into the groups of the previous runs, which stay in memory
+            groups = self.state
+            memory_limit = None
+
+        if isinstance(self.source, _MapNode) and self.source.workers:
+            # map-side combine: workers send partial states of groups instead of rows
+            parts = parallel_map_aggregate(
+                self.source.mapper, self.source.source, self.group_by, aggregations,
+                self.source.workers, self.source.batch_size
+            )
+        elif getattr(self.source, "produces_batches", False):
+            parts = self.aggregate_batches(aggregations)
+        else:
+            parts = None
+
+        if parts is not None:
+            for group_key, part_states in parts:
+                states = groups.get(group_key)
+                if states is None:
+                    if memory_limit and len(groups) >= memory_limit:
+                        partitions = self.spill_groups(groups, partitions)
+                        groups = dict()
+                    groups[group_key] = part_states
+                else:
+                    groups[group_key] = merge_states(aggregations, states, part_states)
+        else:
+            key = self.key_getter(self.group_by)
+            for row in self.source:
+                group_key = key(row)
+                states = groups.get(group_key)
+                if states is None:
+                    if memory_limit and len(groups) >= memory_limit:
+                        partitions = self.spill_groups(groups, partitions)
+                        groups = dict()
+                    states = groups[group_key] = [aggregation.init() for aggregation in aggregations]
+                for i, aggregation in enumerate(aggregations):
+                    states[i] = aggregation.update(states[i], row)
+
+        if partitions is None:
+            for group_key, states in sorted(groups.items()) if self.sort else groups.items():
+                yield self.make_row(group_key, states)
+            return
+
+        partitions = self.spill_groups(groups, partitions)
+        try:
+            merged = [self.merge_partition(partition, aggregations) for partition in partitions]
+            merged = heapq.merge(*merged, key=itemgetter(0)) if self.sort else chain(*merged)
+            for group_key, states in merged:
+                yield self.make_row(group_key, states)
+        finally:
+            for partition in partitions:
+                partition.close()
+
+    def aggregate_batches(self, aggregations):
+        """:return: partial states of groups for every batch of the source"""
+        for batch in self.source.iter_batches():
+            keys, groups = group_indexes(batch, self.group_by)
+            batch_states = [aggregation.update_batch(batch, groups, len(keys)) for aggregation in aggregations]
+            for group_key, states in zip(keys, zip(*batch_states)):
+                yield group_key, list(states)
+
+    def spill_groups(self, groups, partitions):
+        if partitions is None:
+            partitions = [_SpillFile() for _ in range(self.SPILL_PARTITIONS)]
+        for group in groups.items():
+            partitions[hash(group[0]) % self.SPILL_PARTITIONS].write(group)
+        return partitions
+
+    def merge_partition(self, partition, aggregations):
+        groups = dict()
+        for group_key, part_states in partition:
+            states = groups.get(group_key)
+            if states is None:
+                groups[group_key] = part_states
+            else:
+                groups[group_key] = merge_states(aggregations, states, part_states)
+        for group in sorted(groups.items()) if self.sort else groups.items():
+            yield group
+
+    def make_row(self, group_key, states):
+        row = dict(zip(self.group_by, group_key))
+        for (column, aggregation), state in zip(self.aggregations.items(), states):
+            row[column] = aggregation.result(state)
+        return row
+
+
 class _JoinNode(_Node):
-    def __init__(self, source, strategy, on, join_by):
+    GRACE_PARTITIONS = 16
+    GRACE_MAX_LEVEL = 3
+    BROADCAST_LIMIT = 1000
+    # max number of rows of a key group of a merge join kept in memory if no memory limit is given
+    GROUP_LIMIT = 100000
+
+    def __init__(self, source, strategy, on, join_by, algorithm="auto", memory_limit=None):
+        """
+        :param algorithm: "merge" for sort-merge join, "hash" for hash join,
+                          "broadcast" for join on a small table kept in memory,
+                          "auto" to use broadcast join when possible and merge join otherwise
+        :param memory_limit: max number of rows of the right table in a hash table,
+                             both tables are partitioned to disk if it is exceeded
+        """
         super(_JoinNode, self).__init__(source)
         self.strategy = strategy
         self.on = on
         self.join_by = join_by
+        self.algorithm = algorithm
+        self.memory_limit = memory_limit
+        self.default_memory_limit = None
+        self.reuse_left_rows = False
+        # new rows of an incremental run are joined
+        self.incremental = False
+        # JoinKeyStats of the last merge join
+        self.key_stats = None
 
     def __iter__(self):
+        if self.algorithm not in ("auto", "merge", "hash", "broadcast"):
+            raise RuntimeError("Invalid join algorithm")
+        if self.produces_batches:
+            return self.run_batch_join()
         if self.strategy == "inner":
             return self.run_inner_join()
         elif self.strategy == "left":
@@ -126,6 +789,28 @@ class _JoinNode(_Node):
         else:
             raise RuntimeError("Invalid join strategy")
 
+    def plan(self, input_order):
+        # rows of a key group of a merge join keep order of the left table only if the right group
+        # fits into memory, so a merge join keeps the order by the join columns alone
+        if self.algorithm == "merge":
+            return tuple(self.join_by)
+        if self.algorithm in ("auto", "broadcast") and self.strategy in ("inner", "left"):
+            # auto join is either a merge join or a broadcast join keeping order of the left table
+            if self.algorithm == "broadcast" or isinstance(self.on._get_last_node(), _FoldNode):
+                return input_order
+            if is_prefix(self.join_by, input_order):
+                return tuple(self.join_by)
+        return ()
+
+    def plan_copies(self, input_owned):
+        # a left row may be changed in place to become the last of its joined rows, left rows are owned
+        # only after operations making their own rows and mappers declared pure or in place
+        self.reuse_left_rows = input_owned and self.eliminate_copies
+        return input_owned and (self.on._output_owned() or self.strategy in ("inner", "left"))
+
+    def explain(self, graph_names):
+        return f"Join({graph_names[self.on]}, by ({', '.join(self.join_by)}), {self.strategy}, {self.algorithm})"
+
     def next_group(self, generator, last_key, left=True):
         try:
             new_key, rows_for_key = next(generator)
@@ -135,14 +820,18 @@ class _JoinNode(_Node):
             return None, None
         return new_key, rows_for_key
 
+    def join_rows(self, left_row, right_rows):
+        """Join a row with the list of rows of the same key"""
+        last = len(right_rows) - 1 if self.reuse_left_rows else -1
+        for i, right_row in enumerate(right_rows):
+            new_row = left_row if i == last else copy_row(left_row)
+            merge_dicts(new_row, right_row, self.join_by)
+            yield new_row
+
     def join_keys(self, left_key, right_key, left_rows_for_key, right_rows_for_key, add_left_only, add_right_only):
         if left_key == right_key:
-            for left_row in left_rows_for_key:
-                right_rows_for_key = list(right_rows_for_key)
-                for right_row in right_rows_for_key:
-                    new_row = dict(left_row)
-                    merge_dicts(new_row, right_row, self.join_by)
-                    yield new_row
+            for row in self.join_groups(left_key, left_rows_for_key, right_rows_for_key):
+                yield row
         elif left_key < right_key:
             if add_left_only:
                 for left_row in left_rows_for_key:
@@ -152,13 +841,69 @@ class _JoinNode(_Node):
                 for right_row in right_rows_for_key:
                     yield right_row
 
+    def join_groups(self, key, left_rows, right_rows):
+        """
+        Join rows of the same key, keeping at most the memory limit of rows of each side in memory.
+        The right group is kept and the left one streamed through it if the right group fits,
+        otherwise the smaller left group is kept and the right one streamed through it.
+        If neither fits (a hot key) the right group is spilled to disk and read once for every
+        block of left rows. Only the first way keeps order of the left table within the group
+        """
+        limit = self.memory_limit or self.default_memory_limit or self.GROUP_LIMIT
+        right_buffer = list(islice(right_rows, limit + 1))
+        if len(right_buffer) <= limit:
+            left_count = 0
+            for left_row in left_rows:
+                left_count += 1
+                for row in self.join_rows(left_row, right_buffer):
+                    yield row
+            self.key_stats.add(key, left_count, len(right_buffer))
+            return
+
+        left_buffer = list(islice(left_rows, limit + 1))
+        if len(left_buffer) <= limit:
+            right_count = 0
+            for right_row in chain(right_buffer, right_rows):
+                right_count += 1
+                for row in self.join_block(left_buffer, right_row):
+                    yield row
+            self.key_stats.add(key, len(left_buffer), right_count, hot=True)
+            return
+
+        spilled = spill(chain(right_buffer, right_rows))
+        del right_buffer
+        self.key_stats.spilled_groups += 1
+        try:
+            left_rows = chain(left_buffer, left_rows)
+            del left_buffer
+            left_count = 0
+            right_count = 0
+            while True:
+                block = list(islice(left_rows, limit))
+                if not block:
+                    break
+                left_count += len(block)
+                right_count = 0
+                for right_row in spilled:
+                    right_count += 1
+                    for row in self.join_block(block, right_row):
+                        yield row
+            self.key_stats.add(key, left_count, right_count, hot=True)
+        finally:
+            spilled.close()
+
+    def join_block(self, left_rows, right_row):
+        """Join the list of left rows kept in memory with a row of the same key"""
+        for left_row in left_rows:
+            new_row = copy_row(left_row)
+            merge_dicts(new_row, right_row, self.join_by)
+            yield new_row
+
     def join_routine(self, left, right, add_left_only=False, add_right_only=False):
-        if self.join_by:
-            left_generator = groupby(left, dictitemgetter(*self.join_by))
-            right_generator = groupby(right, dictitemgetter(*self.join_by))
-        else:
-            left_generator = groupby(left, lambda x: 0)  # returns the same for all rows
-            right_generator = groupby(right, lambda x: 0)
+        # the key of a cross join is the same empty tuple for all rows
+        key = self.key_getter(self.join_by)
+        left_generator = groupby(left, key)
+        right_generator = groupby(right, key)
 
         left_key, left_rows_for_key = self.next_group(left_generator, None)
         right_key, right_rows_for_key = self.next_group(right_generator, None, False)
@@ -188,18 +933,109 @@ class _JoinNode(_Node):
                 yield row
             key, rows_for_key = self.next_group(generator, key, left)
 
+    def hash_join_routine(self, left, right, add_left_only=False, add_right_only=False, memory_limit=None, level=0):
+        key = self.key_getter(self.join_by)
+        right = iter(right)
+        table = defaultdict(list)
+        for rows_count, right_row in enumerate(right, 1):
+            table[key(right_row)].append(right_row)
+            if memory_limit and rows_count >= memory_limit and level < self.GRACE_MAX_LEVEL:
+                right = chain(chain.from_iterable(table.values()), right)
+                for row in self.grace_hash_join(left, right, add_left_only, add_right_only, memory_limit, level):
+                    yield row
+                return
+
+        matched_keys = set()
+        for left_row in left:
+            left_key = key(left_row)
+            right_rows_for_key = table.get(left_key)
+            if right_rows_for_key:
+                if add_right_only:
+                    matched_keys.add(left_key)
+                for row in self.join_rows(left_row, right_rows_for_key):
+                    yield row
+            elif add_left_only:
+                yield left_row
+
+        if add_right_only:
+            for right_key, right_rows_for_key in table.items():
+                if right_key not in matched_keys:
+                    for right_row in right_rows_for_key:
+                        yield right_row
+
+    def grace_hash_join(self, left, right, add_left_only, add_right_only, memory_limit, level):
+        key = self.key_getter(self.join_by)
+        right_partitions = hash_partition(right, key, self.GRACE_PARTITIONS, salt=level)
+        left_partitions = hash_partition(left, key, self.GRACE_PARTITIONS, salt=level)
+        try:
+            for left_partition, right_partition in zip(left_partitions, right_partitions):
+                for row in self.hash_join_routine(
+                        left_partition, right_partition, add_left_only, add_right_only, memory_limit, level + 1
+                ):
+                    yield row
+        finally:
+            for partition in left_partitions + right_partitions:
+                partition.close()
+
+    def get_algorithm(self):
+        # new rows of an incremental run are not sorted, and the aggregation after the join doesn't need the order
+        if self.incremental and self.algorithm != "broadcast":
+            return "hash"
+        if self.algorithm != "auto":
+            return self.algorithm
+        # broadcast join keeps order of the left table only for these strategies
+        if self.strategy in ("inner", "left"):
+            if isinstance(self.on._get_last_node(), _FoldNode):
+                return "broadcast"
+            if self.on._store and len(self.on._result) <= self.BROADCAST_LIMIT:
+                return "broadcast"
+        return "merge"
+
+    @property
+    def produces_batches(self):
+        """Batches are joined by columns with the right table in memory for inner hash and broadcast joins"""
+        return (
+            getattr(self.source, "produces_batches", False) and self.strategy == "inner"
+            and not (self.memory_limit or self.default_memory_limit) and self.get_algorithm() in ("hash", "broadcast")
+        )
+
+    def iter_batches(self):
+        right = rows_to_batch(list(self.on._result))
+        if not batch_length(right):
+            return
+        for batch in self.source.iter_batches():
+            joined = join_batches(batch, right, self.join_by)
+            if batch_length(joined):
+                yield joined
+
+    def run_batch_join(self):
+        for batch in self.iter_batches():
+            for row in batch_to_rows(batch):
+                yield row
+
+    def join(self, add_left_only=False, add_right_only=False):
+        algorithm = self.get_algorithm()
+        if algorithm == "hash":
+            memory_limit = self.memory_limit or self.default_memory_limit
+            return self.hash_join_routine(self.source, self.on._result, add_left_only, add_right_only, memory_limit)
+        if algorithm == "broadcast":
+            # the right table is loaded once, the left one is streamed through it
+            return self.hash_join_routine(self.source, self.on._result, add_left_only, add_right_only)
+        self.key_stats = JoinKeyStats()
+        return self.join_routine(self.source, self.on._result, add_left_only, add_right_only)
+
     def run_inner_join(self):
-        for row in self.join_routine(self.source, self.on._result):
+        for row in self.join():
             yield row
 
     def run_left_join(self):
-        for row in self.join_routine(self.source, self.on._result, add_left_only=True):
+        for row in self.join(add_left_only=True):
             yield row
 
     def run_right_join(self):
-        for row in self.join_routine(self.source, self.on._result, add_right_only=True):
+        for row in self.join(add_right_only=True):
             yield row
 
     def run_outer_join(self):
-        for row in self.join_routine(self.source, self.on._result, add_left_only=True, add_right_only=True):
+        for row in self.join(add_left_only=True, add_right_only=True):
             yield row
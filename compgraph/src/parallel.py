@@ -0,0 +1,124 @@
+"""
+Helpers to run parts of computations in a pool of worker processes.
+Functions sent to workers (mappers, reducers) should be picklable,
+i.e. defined at the module level.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from itertools import islice, groupby
+from operator import itemgetter
+import heapq
+
+from .spill import _SpillFile, hash_partition
+from .keys import key_getter, key_dict
+
+
+def batches(rows, batch_size):
+    """Split an iterable into lists of batch_size rows"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def map_batch(mapper, batch):
+    return [res_row for row in batch for res_row in mapper(row)]
+
+
+def pool_map(pool, function, tasks, max_in_flight, ordered=True):
+    """
+    Lazily submit function(*task) for every task to the pool, keeping
+    at most max_in_flight of them running, and yield their results
+    :param ordered: yield results in order of tasks or as soon as they are ready
+    """
+    if ordered:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    else:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(function, *task))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def parallel_map(mapper, rows, workers, batch_size, ordered=True):
+    """Run mapper over batches of rows in a pool of processes"""
+    with ProcessPoolExecutor(workers) as pool:
+        tasks = ((mapper, batch) for batch in batches(rows, batch_size))
+        for res_batch in pool_map(pool, map_batch, tasks, 2 * workers, ordered):
+            for res_row in res_batch:
+                yield res_row
+
+
+def map_aggregate_batch(mapper, group_by, aggregations, batch):
+    """
+    Map a batch of rows and aggregate the result (map-side combine)
+    :return: list of (key, partial states of aggregations) for groups of the batch
+    """
+    key = key_getter(group_by)
+    groups = dict()
+    for row in batch:
+        for res_row in mapper(row):
+            group_key = key(res_row)
+            states = groups.get(group_key)
+            if states is None:
+                states = groups[group_key] = [aggregation.init() for aggregation in aggregations]
+            for i, aggregation in enumerate(aggregations):
+                states[i] = aggregation.update(states[i], res_row)
+    return list(groups.items())
+
+
+def parallel_map_aggregate(mapper, rows, group_by, aggregations, workers, batch_size):
+    """Run mapper with combining aggregation over batches of rows in a pool of processes"""
+    with ProcessPoolExecutor(workers) as pool:
+        tasks = ((mapper, group_by, aggregations, batch) for batch in batches(rows, batch_size))
+        for groups in pool_map(pool, map_aggregate_batch, tasks, 2 * workers, ordered=False):
+            for group in groups:
+                yield group
+
+
+def sort_reduce_partition(reducer, reduce_by, sort_by, path):
+    """
+    Sort a partition and reduce it
+    :return: path to a spill file with (key, row) pairs
+    """
+    partition = _SpillFile(path)
+    key = key_getter(reduce_by)
+    result = _SpillFile()
+    for key_values, rows in groupby(sorted(partition, key=key_getter(sort_by)), key):
+        for row in reducer(key_dict(reduce_by, key_values), rows):
+            result.write((key_values, row))
+    partition.close()
+    return result.finish().path
+
+
+def parallel_sort_reduce(reducer, reduce_by, sort_by, rows, workers):
+    """
+    Shuffle rows into hash partitions by reduce_by columns,
+    sort and reduce every partition in a pool of processes
+    and merge the results back in the order of keys
+    """
+    partitions = hash_partition(rows, key_getter(reduce_by), workers)
+    results = list()
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            tasks = [pool.submit(sort_reduce_partition, reducer, reduce_by, sort_by, p.path) for p in partitions]
+            results = [_SpillFile(task.result()) for task in tasks]
+        for key_values, row in heapq.merge(*results, key=itemgetter(0)):
+            yield row
+    finally:
+        for spill_file in partitions + results:
+            spill_file.close()
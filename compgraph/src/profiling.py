@@ -0,0 +1,244 @@
+"""
+Profiling of runs of graphs: statistics of every operation collected by run(profile=True).
+
+Time of an operation is measured without the time of the operations it reads
+rows from, and the time spent in its user function (mapper, reducer, folder)
+is told apart from the time spent in the framework. The statistics are shown
+by ComputeGraph.explain and passed to hooks at the end of a run:
+
+    def report(stats):
+        metrics.gauge(f"{stats.graph}.{stats.operation}.rows_per_second", stats.rows_per_second)
+
+    rows = list(graph.run(docs=docs, profile=Profiler(hooks=[report])))
+    print(graph.explain())
+"""
+
+from threading import local
+from time import perf_counter, thread_time
+import tracemalloc
+import types
+
+from .batch import batch_length
+
+
+class NodeStats:
+    """Statistics of an operation in a profiled run"""
+    def __init__(self):
+        self.graph = None
+        self.operation = None
+        self.rows_in = 0
+        self.rows_out = 0
+        self.batch_rows_out = 0
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self.user_wall_time = 0.
+        self.user_cpu_time = 0.
+        self.peak_memory = 0
+        # JoinKeyStats of a merge join
+        self.key_stats = None
+
+    @property
+    def framework_time(self):
+        """Wall time of the operation out of its user function"""
+        return self.wall_time - self.user_wall_time
+
+    @property
+    def rows_per_second(self):
+        return self.rows_out / self.wall_time if self.wall_time else 0.
+
+    def __repr__(self):
+        return (
+            f"rows {self.rows_in} -> {self.rows_out}, {self.wall_time:.3f} s "
+            f"(user {self.user_wall_time:.3f} s, framework {self.framework_time:.3f} s), "
+            f"cpu {self.cpu_time:.3f} s, {self.rows_per_second:.0f} rows/s, "
+            f"peak memory {self.peak_memory / 2 ** 20:.1f} MiB"
+        ) + (f"; {self.key_stats}" if self.key_stats is not None else "")
+
+
+class JoinKeyStats:
+    """
+    Sizes of groups of rows of the same key joined by a merge join.
+    Keys of right groups bigger than the limit of rows in memory are hot keys
+    """
+    # hot keys shown by repr
+    SHOWN_HOT_KEYS = 5
+
+    def __init__(self):
+        self.groups = 0
+        self.left_rows = 0
+        self.right_rows = 0
+        self.max_left_group = 0
+        self.max_right_group = 0
+        # sizes of groups of hot keys: {key: (left rows, right rows)}
+        self.hot_keys = dict()
+        # number of groups whose right rows were spilled to disk
+        self.spilled_groups = 0
+
+    def add(self, key, left_rows, right_rows, hot=False):
+        self.groups += 1
+        self.left_rows += left_rows
+        self.right_rows += right_rows
+        self.max_left_group = max(self.max_left_group, left_rows)
+        self.max_right_group = max(self.max_right_group, right_rows)
+        if hot:
+            self.hot_keys[key] = (left_rows, right_rows)
+
+    def __repr__(self):
+        hot_keys = sorted(self.hot_keys.items(), key=lambda item: item[1][0] * item[1][1], reverse=True)
+        shown = ", ".join(f"{key!r} {left}x{right}" for key, (left, right) in hot_keys[:self.SHOWN_HOT_KEYS])
+        return (
+            f"key groups {self.groups}, max group {self.max_left_group} x {self.max_right_group} rows, "
+            f"hot keys {len(self.hot_keys)}" + (f" ({shown})" if shown else "")
+            + f", spilled groups {self.spilled_groups}"
+        )
+
+
+class Profiler:
+    """
+    Collector of statistics of operations in a run of graphs.
+    Peak memory of an operation is the most memory traced by tracemalloc at the end of its steps
+    """
+    # attributes of nodes with their user functions
+    USER_FUNCTIONS = ("mapper", "reducer", "folder")
+
+    def __init__(self, hooks=(), trace_memory=True):
+        """
+        :param hooks: functions called with NodeStats of every operation at the end of a run
+        :param trace_memory: whether to trace memory with tracemalloc, it slows the run down
+        """
+        self.hooks = list(hooks)
+        self.trace_memory = trace_memory
+        self.stats = dict()
+        self._local = local()
+        self._wrapped = list()
+        self._started_tracing = False
+
+    def attach(self, nodes):
+        """Start profiling the nodes"""
+        self.stats = dict()
+        for node in nodes:
+            if node in self.stats:
+                continue
+            self.stats[node] = NodeStats()
+            node.profiler = self
+            # functions sent to worker processes should stay picklable
+            if getattr(node, "workers", None):
+                continue
+            for name in self.USER_FUNCTIONS:
+                function = vars(node).get(name)
+                if function is not None:
+                    self._wrapped.append((node, name, function))
+                    setattr(node, name, self.user_function(self.stats[node], function))
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def detach(self, graphs, graph_names):
+        """Stop profiling, sum up the statistics of the graphs' operations and pass them to the hooks"""
+        for node, name, function in self._wrapped:
+            setattr(node, name, function)
+        self._wrapped = list()
+        for node in self.stats:
+            node.profiler = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        for stats in self.stats.values():
+            stats.rows_out = max(stats.rows_out, stats.batch_rows_out)
+        for g in graphs:
+            for node in g._nodes:
+                stats = self.stats[node]
+                stats.graph = graph_names[g]
+                stats.operation = node.explain(graph_names)
+                stats.key_stats = getattr(node, "key_stats", None)
+                # a stored graph is read from its store rather than from its nodes
+                on = getattr(node, "on", None)
+                if on is not None and on._store and on._get_last_node() in self.stats:
+                    stats.rows_in += self.stats[on._get_last_node()].rows_out
+        for g in graphs:
+            for node in g._nodes:
+                for hook in self.hooks:
+                    hook(self.stats[node])
+
+    def timed(self, stats, user, step, *args):
+        """Call step(*args) and add its time to the statistics, without the time of profiled steps inside it"""
+        stack = self._local.__dict__.setdefault("stack", list())
+        children = [0., 0., stats]
+        stack.append(children)
+        wall, cpu = perf_counter(), thread_time()
+        try:
+            return step(*args)
+        finally:
+            wall, cpu = perf_counter() - wall, thread_time() - cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            wall -= children[0]
+            cpu -= children[1]
+            stats.wall_time += wall
+            stats.cpu_time += cpu
+            if user:
+                stats.user_wall_time += wall
+                stats.user_cpu_time += cpu
+            if self.trace_memory:
+                stats.peak_memory = max(stats.peak_memory, tracemalloc.get_traced_memory()[0])
+
+    def consumer(self, stats):
+        """:return: statistics of the operation reading rows from the operation with the stats now, if any"""
+        stack = self._local.__dict__.get("stack")
+        if stack and stack[-1][2] is not stats:
+            return stack[-1][2]
+        return None
+
+    def rows(self, stats, rows, user=False):
+        """Profile iteration over rows of a node, or over rows yielded by its user function"""
+        rows = iter(rows)
+        while True:
+            try:
+                row = self.timed(stats, user, next, rows)
+            except StopIteration:
+                return
+            if not user:
+                stats.rows_out += 1
+                consumer = self.consumer(stats)
+                if consumer is not None:
+                    consumer.rows_in += 1
+            yield row
+
+    def batches(self, stats, batches):
+        """Profile iteration over columnar batches of a node"""
+        batches = iter(batches)
+        while True:
+            try:
+                batch = self.timed(stats, False, next, batches)
+            except StopIteration:
+                return
+            stats.batch_rows_out += batch_length(batch)
+            consumer = self.consumer(stats)
+            if consumer is not None:
+                consumer.rows_in += batch_length(batch)
+            yield batch
+
+    def user_function(self, stats, function):
+        def profiled(*args):
+            result = self.timed(stats, True, function, *args)
+            # mappers and reducers are generators, they run while their rows are taken
+            if isinstance(result, types.GeneratorType):
+                return self.rows(stats, result, user=True)
+            return result
+        return profiled
+
+
+def profiled_iteration(method, batches=False):
+    """Wrap __iter__ or iter_batches of a node class to profile nodes with a profiler attached"""
+    def iterate(self):
+        result = method(self)
+        if self.profiler is None:
+            return result
+        stats = self.profiler.stats[self]
+        return self.profiler.batches(stats, result) if batches else self.profiler.rows(stats, result)
+    iterate.__name__ = method.__name__
+    iterate.__doc__ = method.__doc__
+    return iterate
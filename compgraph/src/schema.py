@@ -0,0 +1,158 @@
+"""
+Compact representation of rows with a declared set of columns.
+
+Rows of a graph with a schema are stored as records: objects with a slot
+for every column of the schema, which take much less memory than dicts.
+Records behave like dicts for mappers, reducers and folders. Columns out of
+the schema may be added to a record, they are kept in a small dict.
+"""
+
+from collections.abc import MutableMapping
+from operator import attrgetter, itemgetter
+
+_MISSING = object()
+
+
+class Schema:
+    _schemas = dict()
+
+    def __new__(cls, columns):
+        # schemas are shared, so that records of the same columns are fast to check and to pickle
+        columns = tuple(columns)
+        schema = cls._schemas.get(columns)
+        if schema is None:
+            schema = super(Schema, cls).__new__(cls)
+            schema._init(columns)
+            cls._schemas[columns] = schema
+        return schema
+
+    def __getnewargs__(self):
+        return self.columns,
+
+    def __getstate__(self):
+        return None
+
+    def _init(self, columns):
+        self.columns = columns
+        self.index = dict((col, i) for i, col in enumerate(columns))
+        self.slots = tuple(f"_{i}" for i in range(len(columns)))
+        self.slot_getters = [attrgetter(slot) for slot in self.slots]
+        # __init__ of records assigns all the slots at once, as namedtuple does
+        args = "".join(f", {slot}" for slot in self.slots)
+        body = "".join(f"    self.{slot} = {slot}\n" for slot in self.slots) + "    self.extra = None\n"
+        namespace = dict()
+        exec(f"def __init__(self{args}):\n{body}", namespace)
+        self.record_type = type("Record", (Record,), {
+            "__slots__": self.slots, "__init__": namespace["__init__"], "schema": self
+        })
+
+    def record(self, row):
+        """Pack a mapping into a record"""
+        if type(row) is self.record_type:
+            return row
+        values = [row.get(col, _MISSING) for col in self.columns]
+        record = self.record_type(*values)
+        if len(row) > len(values) or _MISSING in values:
+            extra = dict((key, val) for key, val in row.items() if key not in self.index)
+            if extra:
+                record.extra = extra
+        return record
+
+    def getter(self, columns):
+        """
+        Replica of itemgetter(*columns), which takes values of records of the schema from their slots
+        """
+        if not columns or any(col not in self.index for col in columns):
+            return itemgetter(*columns)
+        values_getter = attrgetter(*(self.slots[self.index[col]] for col in columns))
+        row_getter = itemgetter(*columns)
+        record_type = self.record_type
+        single = len(columns) == 1
+
+        def get(row):
+            if type(row) is record_type:
+                values = values_getter(row)
+                # a column missing in a record raises KeyError, as for dicts
+                if values is _MISSING or not single and _MISSING in values:
+                    return row_getter(row)
+                return values
+            return row_getter(row)
+        return get
+
+
+class Record(MutableMapping):
+    """Base class for records of schemas"""
+    __slots__ = ("extra",)
+    schema = None
+
+    def _values(self):
+        return [getter(self) for getter in self.schema.slot_getters]
+
+    def __getitem__(self, key):
+        index = self.schema.index.get(key)
+        if index is not None:
+            value = self.schema.slot_getters[index](self)
+            if value is not _MISSING:
+                return value
+        elif self.extra is not None:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        index = self.schema.index.get(key)
+        if index is not None:
+            setattr(self, self.schema.slots[index], value)
+        else:
+            if self.extra is None:
+                self.extra = dict()
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        index = self.schema.index.get(key)
+        if index is not None:
+            setattr(self, self.schema.slots[index], _MISSING)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        index = self.schema.index.get(key)
+        if index is not None:
+            return self.schema.slot_getters[index](self) is not _MISSING
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for col, value in zip(self.schema.columns, self._values()):
+            if value is not _MISSING:
+                yield col
+        if self.extra:
+            for key in self.extra:
+                yield key
+
+    def __len__(self):
+        length = sum(1 for value in self._values() if value is not _MISSING)
+        return length + len(self.extra) if self.extra else length
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return _unpickle_record, (self.schema.columns, dict(self))
+
+    def copy(self):
+        record = type(self)(*self._values())
+        if self.extra:
+            record.extra = dict(self.extra)
+        return record
+
+
+def _unpickle_record(columns, row):
+    return Schema(columns).record(row)
+
+
+def copy_row(row):
+    """Copy a row keeping its representation"""
+    if isinstance(row, Record):
+        return row.copy()
+    return dict(row)
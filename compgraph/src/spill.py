@@ -0,0 +1,82 @@
+"""
+Temporary on-disk storage for tables which do not fit into memory.
+"""
+
+import os
+import pickle
+import tempfile
+
+
+class _SpillFile:
+    """
+    Table of rows written to a temporary file in pickled chunks.
+    The file is referenced by its path, so it may be passed to another process.
+    """
+    def __init__(self, path=None, chunk_size=1024):
+        """
+        :param path: path of an existing spill file to be read, None to create a new one
+        """
+        self.chunk_size = chunk_size
+        self._chunk = list()
+        if path is None:
+            fd, self.path = tempfile.mkstemp(prefix="compgraph-", suffix=".spill")
+            self.file = os.fdopen(fd, "wb")
+        else:
+            self.path = path
+            self.file = None
+
+    def write(self, row):
+        self._chunk.append(row)
+        if len(self._chunk) >= self.chunk_size:
+            self._flush()
+
+    def write_all(self, rows):
+        for row in rows:
+            self.write(row)
+        return self
+
+    def _flush(self):
+        if self._chunk:
+            pickle.dump(self._chunk, self.file, pickle.HIGHEST_PROTOCOL)
+            self._chunk = list()
+
+    def finish(self):
+        """Finish writing, the file can be read by other processes after that"""
+        if self.file is not None:
+            self._flush()
+            self.file.close()
+            self.file = None
+        return self
+
+    def __iter__(self):
+        self.finish()
+        with open(self.path, "rb") as file:
+            while True:
+                try:
+                    chunk = pickle.load(file)
+                except EOFError:
+                    return
+                for row in chunk:
+                    yield row
+
+    def close(self):
+        """Remove the file"""
+        self.finish()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def spill(rows):
+    """Write rows to a new spill file"""
+    return _SpillFile().write_all(rows).finish()
+
+
+def hash_partition(rows, key, partitions_count, salt=None):
+    """
+    Split rows into spill files by hash of their keys
+    :param salt: value mixed into hashes to get partitioning independent from the one with another salt
+    """
+    partitions = [_SpillFile() for _ in range(partitions_count)]
+    for row in rows:
+        partitions[hash((salt, key(row))) % partitions_count].write(row)
+    return [partition.finish() for partition in partitions]
@@ -0,0 +1,189 @@
+"""
+Stores of tables which are read several times: results of graphs read by
+several graphs and input streams shared by graphs.
+
+MemoryStore keeps rows in a list. DiskStore writes them to a temporary file
+in a compact binary format and replays them from a memory map, so that big
+tables don't stay on the heap. Any class with the same interface may be
+passed to ComputeGraph.run as a store: it is created without arguments,
+filled once with write_all, iterated any number of times and closed.
+"""
+
+from array import array
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+from .schema import Schema, Record
+
+
+class MemoryStore(list):
+    """Table kept in memory as a list of rows"""
+    # rows read from the store are the stored objects themselves
+    shares_rows = True
+
+    def write_all(self, rows):
+        self.extend(rows)
+        return self
+
+    def close(self):
+        del self[:]
+
+
+# size of the payload of a frame and number of rows in it
+_FRAME_HEADER = struct.Struct("<QI")
+
+
+class DiskStore:
+    """
+    Table written to a temporary file by frames of rows.
+    A frame is a header followed by pickled columns of its rows: names of columns
+    are kept once for all rows of the same columns, and string columns are
+    dictionary-encoded. Records of schemas are decoded to records. Every iterator decodes
+    its own rows, so they may be changed.
+    """
+    shares_rows = False
+
+    def __init__(self, frame_size=4096, path=None):
+        """
+        :param path: path of the file to be written, a temporary file by default.
+            Only temporary files are removed by close
+        """
+        self.frame_size = frame_size
+        self.rows_count = 0
+        self.path = path
+        self.temporary = path is None
+        self._map = None
+
+    def write_all(self, rows):
+        if self.temporary:
+            fd, self.path = tempfile.mkstemp(prefix="compgraph-", suffix=".store")
+            file = os.fdopen(fd, "w+b")
+        else:
+            file = open(self.path, "w+b")
+        with file:
+            frame = list()
+            for row in rows:
+                frame.append(row)
+                if len(frame) >= self.frame_size:
+                    self._write_frame(file, frame)
+                    frame = list()
+            if frame:
+                self._write_frame(file, frame)
+            file.flush()
+            self._map_file(file)
+        return self
+
+    @classmethod
+    def open(cls, path):
+        """Read a store written to the path before"""
+        store = cls(path=path)
+        with open(path, "rb") as file:
+            store._map_file(file)
+        data = store._map
+        offset = 0
+        while data is not None and offset < len(data):
+            size, rows_count = _FRAME_HEADER.unpack_from(data, offset)
+            store.rows_count += rows_count
+            offset += _FRAME_HEADER.size + size
+        return store
+
+    def _map_file(self, file):
+        # the map keeps its own handle of the file, an empty file can't be mapped
+        if os.fstat(file.fileno()).st_size:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _write_frame(self, file, rows):
+        payload = pickle.dumps(encode_frame(rows), pickle.HIGHEST_PROTOCOL)
+        file.write(_FRAME_HEADER.pack(len(payload), len(rows)))
+        file.write(payload)
+        self.rows_count += len(rows)
+
+    def __iter__(self):
+        data = self._map
+        if data is None:
+            return
+        offset = 0
+        while offset < len(data):
+            size, _ = _FRAME_HEADER.unpack_from(data, offset)
+            offset += _FRAME_HEADER.size
+            for row in decode_frame(pickle.loads(data[offset:offset + size])):
+                yield row
+            offset += size
+
+    def __len__(self):
+        return self.rows_count
+
+    def close(self):
+        """Remove the file if it is temporary"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self.temporary and self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+            self.path = None
+
+
+def encode_column(values):
+    """:return: pair of distinct values and array of their codes for a string column, (None, values) otherwise"""
+    if set(map(type, values)) != {str}:
+        return None, values
+    codes = dict()
+    for value in values:
+        if value not in codes:
+            codes[value] = len(codes)
+    return list(codes), array("I", map(codes.__getitem__, values))
+
+
+def decode_column(column):
+    uniques, values = column
+    if uniques is None:
+        return values
+    return list(map(uniques.__getitem__, values))
+
+
+def encode_frame(rows):
+    """
+    :return: distinct tuples of columns of the rows (shapes), numbers of rows of every shape,
+        encoded columns of every shape, array with the shape of every row if there are several shapes,
+        and columns of the schema of records of every shape if there are records
+    """
+    shapes = dict()
+    shape_rows = list()
+    row_shapes = array("I")
+    for row in rows:
+        shape = (row.schema.columns if isinstance(row, Record) else None, tuple(row))
+        index = shapes.get(shape)
+        if index is None:
+            index = shapes[shape] = len(shapes)
+            shape_rows.append(list())
+        row_shapes.append(index)
+        shape_rows[index].append(tuple(row.values()))
+    columns = [[encode_column(column) for column in zip(*values)] for values in shape_rows]
+    counts = [len(values) for values in shape_rows]
+    schemas = [schema for schema, _ in shapes]
+    return (
+        [shape for _, shape in shapes], counts, columns, row_shapes if len(shapes) > 1 else None,
+        schemas if any(schemas) else None
+    )
+
+
+def decode_frame(frame):
+    """:return: list of rows of an encoded frame, records for rows which were records"""
+    shapes, counts, columns, row_shapes = frame[:4]
+    # frames written before records were kept have no schemas
+    schemas = frame[4] if len(frame) > 4 and frame[4] is not None else [None] * len(shapes)
+    shape_rows = list()
+    for shape, count, shape_columns, schema in zip(shapes, counts, columns, schemas):
+        if shape:
+            values = zip(*map(decode_column, shape_columns))
+            rows = [dict(zip(shape, row_values)) for row_values in values]
+        else:
+            rows = [dict() for _ in range(count)]
+        shape_rows.append(rows if schema is None else list(map(Schema(schema).record, rows)))
+    if row_shapes is None:
+        return shape_rows[0]
+    shape_rows = [iter(rows) for rows in shape_rows]
+    return [next(shape_rows[index]) for index in row_shapes]
@@ -3,6 +3,7 @@ from pytest import approx
 from operator import itemgetter
 
 from compgraph.compgraph import algorithms
+from compgraph.compgraph.src.store import DiskStore
 
 
 def sorted_eq(tb1, tb2, key):
@@ -30,6 +31,61 @@ def test_word_count():
     assert list(result) == etalon
 
 
+def test_word_count_parallel():
+    docs = [
+        {'doc_id': i, 'text': 'hello, my little WORLD' if i % 2 else 'Hello, my little little hell'}
+        for i in range(100)
+    ]
+
+    etalon = [
+        {'count': 50, 'text': 'hell'},
+        {'count': 50, 'text': 'world'},
+        {'count': 100, 'text': 'hello'},
+        {'count': 100, 'text': 'my'},
+        {'count': 150, 'text': 'little'}
+    ]
+
+    g = algorithms.build_word_count_graph('docs', workers=2)
+
+    result = g.run(docs=docs)
+    assert list(result) == etalon
+
+
+def test_word_count_top():
+    docs = [
+        {'doc_id': 1, 'text': 'hello, my little WORLD'},
+        {'doc_id': 2, 'text': 'Hello, my little little hell'}
+    ]
+
+    g = algorithms.build_word_count_graph('docs', top=1)
+
+    result = g.run(docs=docs)
+    assert list(result) == [{'count': 3, 'text': 'little'}]
+
+
+def test_word_count_incremental():
+    docs = [
+        {'doc_id': 1, 'text': 'hello, my little WORLD'},
+        {'doc_id': 2, 'text': 'Hello, my little little hell'}
+    ]
+
+    etalon = [
+        {'count': 1, 'text': 'hell'},
+        {'count': 1, 'text': 'world'},
+        {'count': 2, 'text': 'hello'},
+        {'count': 2, 'text': 'my'},
+        {'count': 3, 'text': 'little'}
+    ]
+
+    g = algorithms.build_word_count_graph('docs')
+
+    assert list(g.run_incremental(docs=docs[:1])) == [
+        {'count': 1, 'text': text} for text in ('hello', 'little', 'my', 'world')
+    ]
+    result = g.run_incremental(docs=docs[1:])
+    assert list(result) == etalon
+
+
 def test_word_count_multiple_call():
     g = algorithms.build_word_count_graph('text')
 
@@ -95,6 +151,18 @@ def test_tf_idf():
     result = g.run(texts=rows)
     assert sorted_eq(etalon, result, ['text', 'doc_id', 'tf_idf'])
 
+    g = algorithms.build_inverted_index_graph('texts', workers=2)
+    result = g.run(texts=rows)
+    assert sorted_eq(etalon, result, ['text', 'doc_id', 'tf_idf'])
+
+    g = algorithms.build_inverted_index_graph('texts')
+    result = g.run(texts=rows, max_workers=3)
+    assert sorted_eq(etalon, result, ['text', 'doc_id', 'tf_idf'])
+
+    g = algorithms.build_inverted_index_graph('texts')
+    result = g.run(texts=rows, store=DiskStore)
+    assert sorted_eq(etalon, result, ['text', 'doc_id', 'tf_idf'])
+
 
 def test_pmi():
     rows = [
@@ -178,3 +246,15 @@ def test_yandex_maps():
 
     assert sorted(result, key=lambda x: (x['weekday'], x['hour'])) == \
         sorted(etalon, key=lambda x: (x['weekday'], x['hour']))
+
+    if algorithms.np is not None:
+        g = algorithms.build_yandex_maps_graph(vectorized=True)
+        result = g.run(edges_input=lengths, times_input=times)
+        assert sorted(result, key=lambda x: (x['weekday'], x['hour'])) == \
+            sorted(etalon, key=lambda x: (x['weekday'], x['hour']))
+
+    g = algorithms.build_yandex_maps_graph()
+    list(g.run_incremental(edges_input=lengths, times_input=times[:3]))
+    result = g.run_incremental(times_input=iter(times[3:]))
+    assert sorted(result, key=lambda x: (x['weekday'], x['hour'])) == \
+        sorted(etalon, key=lambda x: (x['weekday'], x['hour']))
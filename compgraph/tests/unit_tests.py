@@ -1,5 +1,19 @@
 from compgraph import ComputeGraph
+from compgraph.src import aggregations
+from compgraph.src.schema import Schema, Record
+from compgraph.src.keys import key_getter
+from compgraph.src.store import DiskStore
+from compgraph.src.files import JsonLinesSource, JsonLinesSink
+from compgraph.src.cache import ResultCache
+from compgraph.src.profiling import Profiler
+from compgraph.src.cluster import Cluster
 import pytest
+import functools
+import os
+import asyncio
+import threading
+import pickle
+import sys
 from operator import itemgetter
 
 COLUMN_KEY = "key"
@@ -11,6 +25,51 @@ def inc_val_mapper(row):
     yield row
 
 
+def sum_reducer(key, rows):
+    res = dict(key)
+    res[COLUMN_VAL] = sum(row[COLUMN_VAL] for row in rows)
+    yield res
+
+
+def val_step():
+    return 1
+
+
+def step_val_mapper(row):
+    row[COLUMN_VAL] += val_step()
+    yield row
+
+
+VAL_THRESHOLD = 2
+
+
+def threshold_mapper(row):
+    if row[COLUMN_VAL] >= VAL_THRESHOLD:
+        yield row
+
+
+def logging_mapper(log, row):
+    """Append the key of every row to the log file, counting calls of the mapper outside of its fingerprint"""
+    with open(log, "a") as file:
+        file.write(f"{row[COLUMN_KEY]}\n")
+    yield row
+
+
+def failing_once_mapper(marker, exit, row):
+    """Fail on the row of key 7 if the marker file doesn't exist yet, killing the process if exit"""
+    if row[COLUMN_KEY] == 7:
+        # the marker is created atomically, so that only one of the workers fails
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            pass
+        else:
+            if exit:
+                os._exit(1)
+            raise ValueError("failing once")
+    yield row
+
+
 class TestLinearOperations:
     def test_empty_graph(self):
         input = [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(10)]
@@ -37,6 +96,19 @@ class TestLinearOperations:
         output = g.run(source=input)
         assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
 
+    def test_parallel_map(self):
+        input = [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(100)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: i + 1} for i in range(100)]
+
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper, workers=2, batch_size=7)
+        assert list(g.run(source=input)) == etalon
+
+        h = ComputeGraph(source="source")
+        h.add_map(inc_val_mapper, workers=2, batch_size=7, ordered=False)
+        output = h.run(source=input)
+        assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
+
     def test_reduce(self):
         def reducer(key, rows):
             res = dict(key)
@@ -51,6 +123,63 @@ class TestLinearOperations:
         output = g.run(source=input)
         assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
 
+    def test_parallel_reduce(self):
+        input = [{COLUMN_KEY: i % 5, COLUMN_VAL: i} for i in range(10)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: 2 * i + 5} for i in range(5)]
+
+        g = ComputeGraph(source="source")
+        g.add_sort(sort_by=COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY, workers=3)
+        assert list(g.run(source=input)) == etalon
+
+    @pytest.mark.parametrize("memory_limit", [None, 3])
+    def test_hash_reduce(self, memory_limit):
+        def keys_reducer(key, rows):
+            res = dict(key)
+            res[COLUMN_VAL] = [row[COLUMN_VAL] for row in rows]
+            yield res
+
+        input = [{COLUMN_KEY: (i * 7) % 5, COLUMN_VAL: i} for i in range(20)]
+        etalon = [{COLUMN_KEY: key, COLUMN_VAL: [i for i in range(20) if (i * 7) % 5 == key]} for key in range(5)]
+
+        g = ComputeGraph(source="source")
+        g.add_reduce(keys_reducer, reduce_by=COLUMN_KEY, presorted=False, memory_limit=memory_limit)
+        assert "hash grouping" in g.explain()
+        assert list(g.run(source=input)) == etalon
+
+        # groups of a sorted table are reduced as they come
+        h = ComputeGraph(source="source")
+        h.add_sort(COLUMN_KEY)
+        h.add_reduce(keys_reducer, reduce_by=COLUMN_KEY, presorted=False)
+        assert "hash grouping" not in h.explain()
+        assert list(h.run(source=input)) == etalon
+
+    @pytest.mark.parametrize("memory_limit", [None, 2])
+    def test_aggregate(self, memory_limit):
+        input = [{COLUMN_KEY: i % 5, COLUMN_VAL: i} for i in range(19, -1, -1)]
+        etalon = [
+            {COLUMN_KEY: i, "count": 4, "sum": 4 * i + 30, "max": i + 15, "half_mean": (4 * i + 30) / 8}
+            for i in range(5)
+        ]
+
+        g = ComputeGraph(source="source")
+        g.add_aggregate(COLUMN_KEY, {
+            "count": aggregations.count(),
+            "sum": aggregations.sum(COLUMN_VAL),
+            "max": aggregations.max(COLUMN_VAL),
+            "half_mean": aggregations.sum(COLUMN_VAL) / aggregations.count() / 2,
+        }, sort=True, memory_limit=memory_limit)
+        assert list(g.run(source=input)) == etalon
+
+    def test_aggregate_map_side_combine(self):
+        input = [{COLUMN_KEY: i % 5, COLUMN_VAL: i} for i in range(100)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: 20 * i + 970} for i in range(5)]
+
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper, workers=2, batch_size=9)
+        g.add_aggregate(COLUMN_KEY, {COLUMN_VAL: aggregations.sum(COLUMN_VAL)}, sort=True)
+        assert list(g.run(source=input)) == etalon
+
     def test_fold(self):
         def folder(rows):
             res = dict()
@@ -74,6 +203,115 @@ class TestLinearOperations:
         output = g.run(source=input)
         assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
 
+    def test_external_sort(self):
+        input = [{COLUMN_KEY: i % 7, COLUMN_VAL: i} for i in range(100, 0, -1)]
+        etalon = sorted(input, key=itemgetter(COLUMN_KEY))
+
+        g = ComputeGraph(source="source")
+        g.add_sort(sort_by=COLUMN_KEY, memory_limit=10)
+        assert list(g.run(source=input)) == etalon
+
+        h = ComputeGraph(source="source")
+        h.add_sort(sort_by=COLUMN_KEY)
+        assert list(h.run(source=input, memory_limit=3)) == etalon
+
+    def test_top_k(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: (i * 7) % 10} for i in range(30)]
+
+        g = ComputeGraph(source="source")
+        g.add_top_k(4, by=COLUMN_VAL, reverse=True)
+        assert list(g.run(source=input)) == sorted(input, key=itemgetter(COLUMN_VAL), reverse=True)[:4]
+
+        etalon = [row for key in range(3) for row in sorted(
+            (row for row in input if row[COLUMN_KEY] == key), key=itemgetter(COLUMN_VAL))[:2]]
+        h = ComputeGraph(source="source")
+        h.add_top_k(2, by=COLUMN_VAL, per=COLUMN_KEY)
+        assert list(h.run(source=input)) == etalon
+
+        f = ComputeGraph(source="source")
+        f.add_sort(COLUMN_KEY)
+        f.add_top_k(2, by=COLUMN_VAL, per=COLUMN_KEY)
+        assert list(f.run(source=input)) == etalon
+
+    def test_limit(self):
+        consumed = list()
+
+        def source():
+            for i in range(100):
+                consumed.append(i)
+                yield {COLUMN_KEY: i, COLUMN_VAL: i}
+
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper)
+        g.add_limit(5)
+        assert list(g.run(source=source())) == [{COLUMN_KEY: i, COLUMN_VAL: i + 1} for i in range(5)]
+        assert len(consumed) == 5
+
+
+class TestBatches:
+    @pytest.fixture(autouse=True)
+    def numpy(self):
+        return pytest.importorskip("numpy")
+
+    def test_map_batch(self):
+        def inc_val_batch_mapper(batch):
+            batch[COLUMN_VAL] = batch[COLUMN_VAL] + 1
+            return batch
+
+        input = [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(10)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: i + 2} for i in range(10)]
+
+        g = ComputeGraph(source="source")
+        g.add_map_batch(inc_val_batch_mapper, batch_size=3)
+        g.add_map_batch(inc_val_batch_mapper)
+        assert list(g.run(source=input)) == etalon
+
+    def test_batch_sort_and_aggregate(self):
+        def identity_batch_mapper(batch):
+            return batch
+
+        input = [{COLUMN_KEY: i % 3, "name": str(i % 2), COLUMN_VAL: 10 - i} for i in range(10)]
+
+        g = ComputeGraph(source="source")
+        g.add_map_batch(identity_batch_mapper, batch_size=4)
+        g.add_sort((COLUMN_KEY, "name"))
+        assert list(g.run(source=input)) == sorted(input, key=itemgetter(COLUMN_KEY, "name"))
+
+        aggregations_dict = {
+            "count": aggregations.count(),
+            "min": aggregations.min(COLUMN_VAL),
+            "max": aggregations.max(COLUMN_VAL),
+            "mean": aggregations.mean(COLUMN_VAL) * 2,
+        }
+        etalon = ComputeGraph(source="source")
+        etalon.add_aggregate((COLUMN_KEY, "name"), aggregations_dict, sort=True)
+
+        h = ComputeGraph(source="source")
+        h.add_map_batch(identity_batch_mapper, batch_size=4)
+        h.add_aggregate((COLUMN_KEY, "name"), aggregations_dict, sort=True)
+        assert list(h.run(source=input)) == list(etalon.run(source=input))
+
+    def test_batch_join(self):
+        def identity_batch_mapper(batch):
+            return batch
+
+        left = [{COLUMN_KEY: i % 4, "name": f"left_{i}", COLUMN_VAL: i} for i in range(10)]
+        right = [{COLUMN_KEY: i % 3, "name": f"right_{i}", "other": i * 10} for i in range(7)]
+
+        etalon = ComputeGraph(source="left")
+        etalon_right = ComputeGraph(source="right")
+        etalon.add_join(etalon_right, join_by=COLUMN_KEY, algorithm="hash")
+
+        right_graph = ComputeGraph(source="right")
+        g = ComputeGraph(source="left")
+        g.add_map_batch(identity_batch_mapper, batch_size=4)
+        g.add_join(right_graph, join_by=COLUMN_KEY, algorithm="hash")
+        assert g._nodes[-1].produces_batches
+
+        output = list(g.run(left=left, right=right))
+        assert output == list(etalon.run(left=left, right=right))
+        assert {"name", ".name", "other"} <= set(output[0])
+
 
 class TestJoins:
     @pytest.fixture(
@@ -107,6 +345,126 @@ class TestJoins:
         output = g.run(left=left_source_for_join, right=right_source_for_join)
         assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
 
+    @pytest.mark.parametrize("memory_limit", [None, 2])
+    def test_hash_join(self, join_params, memory_limit):
+        strategy, etalon = join_params
+
+        left_source_for_join = [
+            {COLUMN_KEY: 2},
+            {COLUMN_KEY: 1},
+        ]
+
+        right_source_for_join = [
+            {COLUMN_KEY: 3},
+            {COLUMN_KEY: 1},
+            {COLUMN_KEY: 4, COLUMN_VAL: 1},
+        ]
+        if strategy in ("right", "outer"):
+            etalon = etalon + [{COLUMN_KEY: 4, COLUMN_VAL: 1}]
+
+        g = ComputeGraph(source="left")
+        h = ComputeGraph(source="right")
+        g.add_join(h, join_by=COLUMN_KEY, strategy=strategy, algorithm="hash", memory_limit=memory_limit)
+        output = g.run(left=left_source_for_join, right=right_source_for_join)
+        assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
+
+    def test_grace_hash_join(self):
+        left = [{COLUMN_KEY: i % 13, COLUMN_VAL: i} for i in range(100)]
+        right = [{COLUMN_KEY: i % 17, "right": i} for i in range(50)]
+
+        g = ComputeGraph(source="left")
+        g.add_sort(COLUMN_KEY)
+        h = ComputeGraph(source="right")
+        h.add_sort(COLUMN_KEY)
+        g.add_join(h, join_by=COLUMN_KEY, strategy="outer")
+        etalon = list(g.run(left=left, right=right))
+
+        g = ComputeGraph(source="left")
+        h = ComputeGraph(source="right")
+        g.add_join(h, join_by=COLUMN_KEY, strategy="outer", algorithm="hash")
+        output = g.run(left=left, right=right, memory_limit=5)
+
+        def row_key(row):
+            return row[COLUMN_KEY], row.get(COLUMN_VAL, -1), row.get("right", -1)
+
+        assert sorted(output, key=row_key) == sorted(etalon, key=row_key)
+
+    def test_merge_join_hot_keys(self, join_params):
+        strategy, _ = join_params
+        # right groups of keys 0, 1 and 3 are bigger than the limit
+        left = [{COLUMN_KEY: 0 if i % 5 else 1 + i % 3, COLUMN_VAL: i} for i in range(100)]
+        right = [{COLUMN_KEY: 0 if i % 2 else 1 + i % 4, "right": i} for i in range(60)]
+
+        g = ComputeGraph(source="left")
+        g.add_sort(COLUMN_KEY)
+        h = ComputeGraph(source="right")
+        h.add_sort(COLUMN_KEY)
+        g.add_join(h, join_by=COLUMN_KEY, strategy=strategy, algorithm="merge")
+        etalon = list(g.run(left=left, right=right))
+        assert g._nodes[-1].key_stats.hot_keys == dict()
+
+        output = list(g.run(left=left, right=right, memory_limit=7, profile=True))
+
+        # rows of hot keys are joined in another order, but keys stay sorted
+        assert [row[COLUMN_KEY] for row in output] == [row[COLUMN_KEY] for row in etalon]
+
+        def row_key(row):
+            return row[COLUMN_KEY], row.get(COLUMN_VAL, -1), row.get("right", -1)
+
+        assert sorted(output, key=row_key) == sorted(etalon, key=row_key)
+        key_stats = g._nodes[-1].key_stats
+        assert key_stats.hot_keys == {(0,): (80, 30), (1,): (7, 15), (3,): (7, 15)}
+        # only the right group of key 0 is spilled, left groups of keys 1 and 3 fit into memory
+        assert key_stats.spilled_groups == 1
+        assert (key_stats.max_left_group, key_stats.max_right_group) == (80, 30)
+        assert "hot keys 3" in g.explain()
+
+    def test_merge_join_hot_key_with_sort(self):
+        left = [{COLUMN_KEY: 0, COLUMN_VAL: i} for i in range(10)]
+        right = [{COLUMN_KEY: 0, "right": i} for i in range(10)]
+
+        g = ComputeGraph(source="left")
+        g.add_sort((COLUMN_KEY, COLUMN_VAL))
+        h = ComputeGraph(source="right")
+        h.add_sort(COLUMN_KEY)
+        g.add_join(h, join_by=COLUMN_KEY, algorithm="merge")
+        g.add_sort((COLUMN_KEY, COLUMN_VAL))
+        output = list(g.run(left=left, right=right, memory_limit=3))
+        # the merge join keeps the order by the key only, so the sort isn't removed
+        assert "removed" not in g.explain().splitlines()[-1]
+        assert g._nodes[-2].key_stats.spilled_groups == 1
+        assert [row[COLUMN_VAL] for row in output] == [i for i in range(10) for _ in range(10)]
+        assert [row["right"] for row in output] == list(range(10)) * 10
+
+    def test_broadcast_join_on_fold(self):
+        consumed = list()
+
+        def source():
+            for i in range(100):
+                consumed.append(i)
+                yield {COLUMN_KEY: i}
+
+        def count_folder(rows):
+            return {"count": sum(1 for _ in rows)}
+
+        g = ComputeGraph(source="left")
+        h = ComputeGraph(source="right")
+        h.add_fold(count_folder)
+        g.add_join(h, strategy="inner")
+        output = g.run(left=source(), right=[{COLUMN_KEY: 0}, {COLUMN_KEY: 1}])
+        assert next(output) == {COLUMN_KEY: 0, "count": 2}
+        assert len(consumed) == 1
+        assert list(output) == [{COLUMN_KEY: i, "count": 2} for i in range(1, 100)]
+
+    def test_broadcast_join(self, join_params):
+        strategy, etalon = join_params
+
+        g = ComputeGraph(source="left")
+        h = ComputeGraph(source="right")
+        g.add_join(h, join_by=COLUMN_KEY, strategy=strategy, algorithm="broadcast")
+        output = g.run(left=[{COLUMN_KEY: 2}, {COLUMN_KEY: 1}], right=[{COLUMN_KEY: 3}, {COLUMN_KEY: 1}])
+        assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
+
     def test_join_same_colunms(self):
         g = ComputeGraph(source="source")
         h = ComputeGraph(source="source")
@@ -150,6 +508,23 @@ class TestInput:
             output = g.run(source=input)
             assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
 
+    def test_streaming_run(self):
+        consumed = list()
+
+        def source():
+            for i in range(1000):
+                consumed.append(i)
+                yield {COLUMN_KEY: i, COLUMN_VAL: i}
+
+        g = ComputeGraph(source="g_source")
+        g.add_map(inc_val_mapper)
+        h = ComputeGraph(source=g)
+        h.add_map(inc_val_mapper)
+        output = h.run(g_source=source())
+        assert next(output) == {COLUMN_KEY: 0, COLUMN_VAL: 2}
+        assert len(consumed) == 1
+        assert len(list(output)) == 999
+
     def test_same_stream_input(self):
         g = ComputeGraph(source="source")
         h = ComputeGraph(source="source")
@@ -162,7 +537,590 @@ class TestInput:
         assert sorted(output, key=itemgetter(COLUMN_KEY)) == etalon
 
 
+class TestSchema:
+    def test_record(self):
+        schema = Schema((COLUMN_KEY, COLUMN_VAL))
+        record = schema.record({COLUMN_KEY: 1, COLUMN_VAL: 2, "other": 3})
+        assert isinstance(record, Record)
+        assert record == {COLUMN_KEY: 1, COLUMN_VAL: 2, "other": 3}
+        record[COLUMN_VAL] += 1
+        del record["other"]
+        del record[COLUMN_KEY]
+        assert dict(record) == {COLUMN_VAL: 3}
+        assert pickle.loads(pickle.dumps(record)) == record
+        assert schema.getter((COLUMN_VAL,))(record) == 3
+        # a missing column raises KeyError as for dicts
+        for columns in ((COLUMN_KEY,), (COLUMN_VAL, COLUMN_KEY)):
+            with pytest.raises(KeyError):
+                key_getter(columns, schema)(record)
+
+    def test_records_stored_on_disk(self):
+        schema = Schema((COLUMN_KEY, COLUMN_VAL))
+        rows = [
+            schema.record({COLUMN_KEY: 1, "other": 2}), {COLUMN_KEY: 2}, schema.record({COLUMN_KEY: 3, COLUMN_VAL: 4})
+        ]
+        store = DiskStore().write_all(rows)
+        try:
+            output = list(store)
+        finally:
+            store.close()
+        assert output == rows
+        assert [type(row) for row in output] == [type(row) for row in rows]
+
+    def test_graph_with_schema(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(10)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: i, "." + COLUMN_VAL: sum(range(i, 10, 3)) + 4 - (i > 0)}
+                  for i in range(3)]
+
+        g = ComputeGraph(source="source", schema=(COLUMN_KEY, COLUMN_VAL))
+        g.add_map(inc_val_mapper)
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        h = ComputeGraph(source="source", schema=(COLUMN_KEY, COLUMN_VAL))
+        h.add_sort(COLUMN_VAL)
+        h.add_join(g, join_by=COLUMN_KEY, algorithm="hash")
+        h.add_sort(COLUMN_KEY)
+        output = list(h.run(source=input))
+        assert all(isinstance(row, Record) for row in output)
+        assert [row for row in output if row[COLUMN_VAL] < 3] == etalon
+        assert input[0] == {COLUMN_KEY: 0, COLUMN_VAL: 0}
+
+
+class TestKeys:
+    def test_key_getter(self):
+        schema = Schema((COLUMN_KEY, COLUMN_VAL))
+        row = {COLUMN_KEY: 1, COLUMN_VAL: 2}
+        for key_schema in (None, schema):
+            assert key_getter((COLUMN_VAL,), key_schema)(row) == (2,)
+            assert key_getter((COLUMN_VAL, COLUMN_KEY), key_schema)(schema.record(row)) == (2, 1)
+        assert key_getter(())(row) == ()
+
+    def test_reducer_key(self):
+        def key_reducer(key, rows):
+            key[COLUMN_VAL] = len(list(rows))
+            yield key
+
+        input = [{COLUMN_KEY: i // 3, "other": i} for i in range(9)]
+
+        g = ComputeGraph(source="source")
+        g.add_reduce(key_reducer, reduce_by=COLUMN_KEY)
+        assert list(g.run(source=input)) == [{COLUMN_KEY: i, COLUMN_VAL: 3} for i in range(3)]
+
+
+class TestStore:
+    def test_disk_store(self):
+        input = [{COLUMN_KEY: str(i % 3), COLUMN_VAL: i} for i in range(10000)]
+        input += [{COLUMN_KEY: 1.0}, dict(), {COLUMN_VAL: [1, 2], COLUMN_KEY: True}]
+        store = DiskStore().write_all(input)
+        assert len(store) == len(input)
+        assert list(store) == input
+        assert [type(row[COLUMN_KEY]) for row in store if COLUMN_KEY in row][-2:] == [float, bool]
+        store.close()
+        assert list(store) == []
+
+    def test_graphs_with_disk_store(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(10)]
+        # the value of the second join overwrites the one of the first join
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: sum(range(i, 10, 3)), "." + COLUMN_VAL: sum(range(i, 10, 3)) + 1}
+                  for i in range(3)]
+
+        g = ComputeGraph(source="source")
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        h = ComputeGraph(source=g)
+        h.add_map(inc_val_mapper)
+        f = ComputeGraph(source="source")
+        f.add_aggregate(COLUMN_KEY, {COLUMN_VAL: aggregations.sum(COLUMN_VAL)}, sort=True)
+        f.add_join(g, join_by=COLUMN_KEY)
+        f.add_join(h, join_by=COLUMN_KEY)
+        output = list(f.run(source=iter(input), store=DiskStore))
+        assert [{key: row[key] for key in etalon[0]} for row in output] == etalon
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestFiles:
+    def test_json_lines(self, tmp_path):
+        input = [{COLUMN_KEY: i, COLUMN_VAL: "value " * i, "other": [i]} for i in range(100)]
+        path = str(tmp_path / "input.jsonl")
+        assert JsonLinesSink(path, batch_size=7).write_all(input) == 100
+
+        assert list(JsonLinesSource(path)) == input
+        assert list(JsonLinesSource(path, workers=2, chunk_size=100)) == input
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: "value " * i} for i in range(100)]
+        assert list(JsonLinesSource(path, columns=(COLUMN_KEY, COLUMN_VAL), chunk_size=1)) == etalon
+
+        (tmp_path / "empty.jsonl").write_text("")
+        assert list(JsonLinesSource(str(tmp_path / "empty.jsonl"))) == []
+
+    def test_graph_with_json_lines(self, tmp_path):
+        input_path, output_path = str(tmp_path / "input.jsonl"), str(tmp_path / "output.jsonl")
+        with open(input_path, "w") as input_file:
+            for i in range(10):
+                input_file.write(f'{{"{COLUMN_KEY}": {i}, "{COLUMN_VAL}": {i}}}\n\n')
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: i + 1} for i in range(10)]
+
+        g = ComputeGraph(source="source", schema=(COLUMN_KEY, COLUMN_VAL))
+        g.add_map(inc_val_mapper)
+        JsonLinesSink(output_path).write_all(g.run(source=JsonLinesSource(input_path)))
+        assert list(JsonLinesSource(output_path)) == etalon
+
+
+class TestCache:
+    def test_cached_results(self, tmp_path):
+        log = tmp_path / "calls.log"
+
+        def calls():
+            return len(log.read_text().splitlines())
+
+        def build_graph(mapper):
+            g = ComputeGraph(source="source")
+            g.add_map(functools.partial(logging_mapper, str(log)))
+            g.add_sort(COLUMN_KEY)
+            g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+            h = ComputeGraph(source="other")
+            h.add_map(mapper)
+            h.add_join(g, join_by=COLUMN_KEY, strategy="left")
+            return h
+
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(10)]
+        other = [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(5)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: i + 1, "." + COLUMN_VAL: sum(range(i, 10, 3))} for i in range(3)]
+        etalon += [{COLUMN_KEY: i, COLUMN_VAL: i + 1} for i in range(3, 5)]
+        cache = ResultCache(str(tmp_path / "cache"))
+
+        assert list(build_graph(inc_val_mapper).run(source=input, other=other, cache=cache)) == etalon
+        assert calls() == 10
+        assert list(build_graph(inc_val_mapper).run(source=input, other=other, cache=cache)) == etalon
+        assert calls() == 10
+
+        # the joined graph is not computed again for a changed mapper
+        def dec_val_mapper(row):
+            row[COLUMN_VAL] -= 1
+            yield row
+
+        output = list(build_graph(dec_val_mapper).run(source=input, other=other, cache=cache))
+        assert [row[COLUMN_VAL] for row in output] == [i - 1 for i in range(5)]
+        assert calls() == 10
+
+        input[0] = {COLUMN_KEY: 0, COLUMN_VAL: 100}
+        output = list(build_graph(inc_val_mapper).run(source=input, other=other, cache=cache))
+        assert output[0]["." + COLUMN_VAL] == 118
+        assert calls() == 20
+
+        # streams are not cached
+        list(build_graph(inc_val_mapper).run(source=iter(input), other=other, cache=cache))
+        assert calls() == 30
+
+    def test_cache_helpers_changed(self, tmp_path, monkeypatch):
+        input = [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(5)]
+        cache = ResultCache(str(tmp_path))
+        g = ComputeGraph(source="source")
+        g.add_map(step_val_mapper)
+        assert list(g.run(source=input, cache=cache)) == [{COLUMN_KEY: i, COLUMN_VAL: i + 1} for i in range(5)]
+
+        # a changed helper called by a global name misses the cache
+        def val_step():
+            return 2
+
+        monkeypatch.setattr(sys.modules[__name__], "val_step", val_step)
+        assert list(g.run(source=input, cache=cache)) == [{COLUMN_KEY: i, COLUMN_VAL: i + 2} for i in range(5)]
+
+        # and so does a changed helper of a closure
+        def build_graph(step):
+            def closure_mapper(row):
+                row[COLUMN_VAL] += step()
+                yield row
+
+            h = ComputeGraph(source="source")
+            h.add_map(closure_mapper)
+            return h
+
+        def step():
+            return 3
+
+        assert list(build_graph(step).run(source=input, cache=cache))[0][COLUMN_VAL] == 3
+
+        def step():  # noqa: F811
+            return 4
+
+        assert list(build_graph(step).run(source=input, cache=cache))[0][COLUMN_VAL] == 4
+
+    def test_cache_values_changed(self, tmp_path, monkeypatch):
+        input = [{COLUMN_KEY: key, COLUMN_VAL: i} for i, key in enumerate("abc")]
+        cache = ResultCache(str(tmp_path))
+
+        # contents of containers of a closure are a part of the fingerprint
+        def build_graph(stopwords):
+            def stopwords_mapper(row):
+                if row[COLUMN_KEY] not in stopwords:
+                    yield row
+
+            g = ComputeGraph(source="source")
+            g.add_map(stopwords_mapper)
+            return g
+
+        assert [row[COLUMN_KEY] for row in build_graph({"a"}).run(source=input, cache=cache)] == ["b", "c"]
+        assert [row[COLUMN_KEY] for row in build_graph({"b"}).run(source=input, cache=cache)] == ["a", "c"]
+
+        # and so are values of globals read by a mapper
+        h = ComputeGraph(source="source")
+        h.add_map(threshold_mapper)
+        assert [row[COLUMN_KEY] for row in h.run(source=input, cache=cache)] == ["c"]
+        monkeypatch.setattr(sys.modules[__name__], "VAL_THRESHOLD", 1)
+        assert [row[COLUMN_KEY] for row in h.run(source=input, cache=cache)] == ["b", "c"]
+
+    def test_cache_eviction(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_size=1000)
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper)
+        for i in range(10):
+            list(g.run(source=[{COLUMN_KEY: j, COLUMN_VAL: i} for j in range(30)], cache=cache))
+        sizes = [path.stat().st_size for path in tmp_path.iterdir()]
+        assert 0 < sum(sizes) <= 1000 and len(sizes) < 10
+
+
+class TestIncremental:
+    def test_incremental_aggregate(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(30)]
+        names = [{COLUMN_KEY: i, "name": str(i)} for i in range(2)]
+
+        h = ComputeGraph(source="names")
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper)
+        g.add_join(h, join_by=COLUMN_KEY, algorithm="hash")
+        g.add_aggregate(("name",), {COLUMN_VAL: aggregations.sum(COLUMN_VAL), "count": aggregations.count()})
+        g.add_sort(COLUMN_VAL)
+
+        def etalon(rows_count):
+            groups = [{"name": str(i), COLUMN_VAL: sum(range(i + 1, rows_count + 1, 3)),
+                       "count": len(range(i, rows_count, 3))} for i in range(2)]
+            return sorted(groups, key=itemgetter(COLUMN_VAL))
+
+        assert list(g.run_incremental(source=input[:10], names=names)) == etalon(10)
+        assert list(g.run_incremental(source=input[10:25])) == etalon(25)
+        assert list(g.run_incremental(source=iter(input[25:]))) == etalon(30)
+        assert list(g.run(source=input[:10], names=names)) == etalon(10)
+
+    def test_incremental_shared_stream(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(30)]
+
+        # the first run reads the stream of the input both for the joined graph and for the new rows
+        totals = ComputeGraph(source="source")
+        totals.add_aggregate(COLUMN_KEY, {"total": aggregations.sum(COLUMN_VAL)})
+        g = ComputeGraph(source="source")
+        g.add_join(totals, join_by=COLUMN_KEY, algorithm="hash")
+        g.add_aggregate(COLUMN_KEY, {"count": aggregations.count(), "total": aggregations.max("total")}, sort=True)
+
+        etalon = [{COLUMN_KEY: i, "count": len(range(i, 10, 3)), "total": sum(range(i, 10, 3))} for i in range(3)]
+        assert list(g.run_incremental(source=iter(input[:10]))) == etalon
+        output = list(g.run_incremental(source=iter(input[10:])))
+        assert [row["count"] for row in output] == [10, 10, 10]
+
+    def test_not_incremental(self):
+        g = ComputeGraph(source="source")
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        g.add_aggregate(COLUMN_KEY, {COLUMN_VAL: aggregations.sum(COLUMN_VAL)})
+        with pytest.raises(RuntimeError):
+            list(g.run_incremental(source=[]))
+
+
+class TestProfiling:
+    def test_profile(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(30)]
+        names = [{COLUMN_KEY: i, "name": str(i)} for i in range(2)]
+
+        h = ComputeGraph(source="names")
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper)
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        g.add_join(h, join_by=COLUMN_KEY)
+
+        etalon = list(g.run(source=input, names=names))
+        stats = list()
+        output = list(g.run(source=input, names=names, profile=Profiler(hooks=[stats.append])))
+        assert output == etalon
+
+        assert [(s.graph, s.operation) for s in stats] == [
+            ("graph 0", "Init"), ("graph 1", "Map(inc_val_mapper)"), ("graph 1", "Sort(key)"),
+            ("graph 1", "Reduce(sum_reducer, by key)"), ("graph 1", "Join(graph 0, by (key), inner, auto)"),
+        ]
+        map_stats, sort_stats, reduce_stats, join_stats = stats[1:]
+        assert (map_stats.rows_in, map_stats.rows_out) == (30, 30)
+        assert (reduce_stats.rows_in, reduce_stats.rows_out) == (30, 3)
+        assert (join_stats.rows_in, join_stats.rows_out) == (5, 2)
+        assert map_stats.user_wall_time > 0 and sort_stats.user_wall_time == 0
+        assert all(0 <= s.framework_time <= s.wall_time and s.peak_memory > 0 for s in stats)
+        # user functions are restored after the run
+        assert g._nodes[0].mapper is inc_val_mapper
+
+        plan = g.explain()
+        assert "rows 30 -> 3" in plan and "rows/s" in plan
+
+
+class TestAsync:
+    def test_async_mapper(self):
+        in_flight = [0, 0]
+
+        async def sleeping_mapper(row):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+            # every row sleeps, so that the window is filled before the first row is done
+            await asyncio.sleep(0.01 * (row[COLUMN_VAL] % 3 + 1))
+            in_flight[0] -= 1
+            yield {COLUMN_KEY: row[COLUMN_KEY], COLUMN_VAL: row[COLUMN_VAL] + 1}
+
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(30)]
+        g = ComputeGraph(source="source")
+        g.add_map(sleeping_mapper, max_in_flight=10)
+        assert list(g.run(source=input)) == [{COLUMN_KEY: i % 3, COLUMN_VAL: i + 1} for i in range(30)]
+        assert in_flight[1] == 10
+        assert "async" in g.explain()
+
+    def test_run_async(self):
+        async def source():
+            for i in range(30):
+                await asyncio.sleep(0)
+                yield {COLUMN_KEY: i % 3, COLUMN_VAL: i}
+
+        async def inc_mapper(row):
+            await asyncio.sleep(0.001 * (row[COLUMN_VAL] % 5))
+            row[COLUMN_VAL] += 1
+            yield row
+
+        names = ComputeGraph(source="names")
+        g = ComputeGraph(source="source")
+        g.add_map(inc_mapper, ordered=False)
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        g.add_join(names, join_by=COLUMN_KEY)
+
+        async def run():
+            names_input = [{COLUMN_KEY: i, "name": str(i)} for i in range(3)]
+            return [row async for row in g.run_async(source=source(), names=names_input, batch_size=2)]
+
+        etalon = [{COLUMN_KEY: key, COLUMN_VAL: sum(range(key + 1, 31, 3)), "name": str(key)} for key in range(3)]
+        assert asyncio.run(run()) == etalon
+
+
+class TestCluster:
+    @staticmethod
+    def build_graph(mapper):
+        names = ComputeGraph(source="names")
+        g = ComputeGraph(source="source")
+        g.add_map(mapper)
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        g.add_join(names, join_by=COLUMN_KEY, strategy="inner")
+        g.add_aggregate("name", {COLUMN_VAL: aggregations.sum(COLUMN_VAL)})
+        g.add_sort(COLUMN_VAL)
+        return g
+
+    def test_cluster_run(self):
+        input = [{COLUMN_KEY: i % 50, COLUMN_VAL: i} for i in range(1000)]
+        names = [{COLUMN_KEY: i, "name": str(i % 7)} for i in range(40)]
+        g = self.build_graph(inc_val_mapper)
+
+        with Cluster(workers=3, split_size=100) as cluster:
+            assert cluster.run(g, source=input, names=names) == list(g.run(source=input, names=names))
+            # the cluster is reused by the next runs
+            assert cluster.run(g, source=input[:10], names=names) == list(g.run(source=input[:10], names=names))
+
+    def test_cluster_equal_keys(self):
+        # equal keys of different types go to the same partition and are reduced together
+        input = [{COLUMN_KEY: key, COLUMN_VAL: 1} for key in [1, 1.0, True, 0, 0.0, False, 2.5] * 30]
+        g = ComputeGraph(source="source")
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+
+        with Cluster(workers=3, split_size=20) as cluster:
+            output = cluster.run(g, source=input)
+        assert sorted(row[COLUMN_VAL] for row in output) == [30, 90, 90]
+
+    @pytest.mark.parametrize("exit", [False, True])
+    def test_cluster_failures(self, tmp_path, exit):
+        input = [{COLUMN_KEY: i % 50, COLUMN_VAL: i} for i in range(1000)]
+        names = [{COLUMN_KEY: i, "name": str(i % 7)} for i in range(40)]
+        g = self.build_graph(functools.partial(failing_once_mapper, str(tmp_path / "marker"), exit))
+
+        with Cluster(workers=3, split_size=100) as cluster:
+            output = cluster.run(g, source=input, names=names)
+            # the failed task is retried, and the tasks of a dead worker run again on the others
+            assert len(cluster._alive_workers()) == (2 if exit else 3)
+        # the mapper doesn't fail anymore
+        assert output == list(g.run(source=input, names=names))
+
+        g = self.build_graph(functools.partial(failing_once_mapper, str(tmp_path / "other_marker"), False))
+        with Cluster(workers=2, split_size=100, max_retries=0) as cluster:
+            with pytest.raises(RuntimeError):
+                cluster.run(g, source=input, names=names)
+
+
+class TestPlanner:
+    def test_fused_maps(self):
+        def split_mapper(row):
+            for i in range(2):
+                yield {COLUMN_KEY: row[COLUMN_KEY], COLUMN_VAL: row[COLUMN_VAL] * 2 + i}
+
+        def odd_mapper(row):
+            if row[COLUMN_VAL] % 2:
+                yield row
+
+        def folder(rows):
+            return {COLUMN_VAL: sum(row[COLUMN_VAL] for row in rows)}
+
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(10)]
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper)
+        g.add_map(split_mapper, pure=True)
+        g.add_map(odd_mapper)
+        for _ in range(20):
+            g.add_map(inc_val_mapper)
+        h = ComputeGraph(source=g)
+        h.add_map(inc_val_mapper)
+        h.add_fold(folder)
+
+        etalon = [{COLUMN_KEY: i % 3, COLUMN_VAL: (i + 1) * 2 + 21} for i in range(10)]
+        # maps of a profiled run aren't fused
+        assert list(g.run(source=input, profile=True)) == etalon
+        assert list(g.run(source=input)) == etalon
+        assert input == [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(10)]
+        plan = g.explain().splitlines()
+        assert plan[1] == "    Map(inc_val_mapper)"
+        assert plan[16] == "    Map(inc_val_mapper) - fused with 15 maps before"
+        assert plan[17] == "    Map(inc_val_mapper)"
+        assert plan[-1] == "    Map(inc_val_mapper) - fused with 6 maps before"
+        # only the maps running the fused generators are marked
+        assert [i for i, line in enumerate(plan) if "fused" in line] == [16, len(plan) - 1]
+
+        assert list(h.run(source=input)) == [{COLUMN_VAL: sum(row[COLUMN_VAL] + 1 for row in etalon)}]
+        plan = h.explain().splitlines()
+        assert plan[-1] == "    Fold(folder) - fused with 1 maps before"
+        assert plan[-2] == "    Map(inc_val_mapper)"
+
+    def test_redundant_sort_removed(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: i} for i in range(10)]
+
+        g = ComputeGraph(source="source")
+        g.add_sort(COLUMN_KEY)
+        g.add_reduce(sum_reducer, reduce_by=COLUMN_KEY)
+        g.add_map(inc_val_mapper, preserves_order=True)
+        g.add_sort(COLUMN_KEY)
+        assert "Sort(key) - removed" in g.explain().splitlines()[-1]
+        assert list(g.run(source=input)) == [{COLUMN_KEY: 0, COLUMN_VAL: 19}, {COLUMN_KEY: 1, COLUMN_VAL: 13},
+                                             {COLUMN_KEY: 2, COLUMN_VAL: 16}]
+
+    def test_sort_within_groups(self):
+        input = [{COLUMN_KEY: i % 3, COLUMN_VAL: -i} for i in range(10)]
+        etalon = sorted(input, key=itemgetter(COLUMN_KEY, COLUMN_VAL))
+
+        g = ComputeGraph(source="source")
+        g.add_sort(COLUMN_KEY)
+        h = ComputeGraph(source=g)
+        h.add_sort((COLUMN_KEY, COLUMN_VAL))
+        assert "within groups of (key)" in h.explain()
+        assert list(h.run(source=input)) == etalon
+
+    def test_map_not_preserving_order(self):
+        def negate_mapper(row):
+            row[COLUMN_KEY] = -row[COLUMN_KEY]
+            yield row
+
+        input = [{COLUMN_KEY: i} for i in range(10)]
+
+        # mappers aren't assumed to keep order unless they are declared to
+        g = ComputeGraph(source="source")
+        g.add_sort(COLUMN_KEY)
+        g.add_map(negate_mapper)
+        g.add_sort(COLUMN_KEY)
+        assert "removed" not in g.explain()
+        assert list(g.run(source=input)) == [{COLUMN_KEY: -i} for i in range(9, -1, -1)]
+
+    def test_copies_eliminated(self):
+        mapped = list()
+
+        def remember_mapper(row):
+            mapped.append(row)
+            yield row
+
+        input = [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(10)]
+        names = [{COLUMN_KEY: i, "name": str(i)} for i in range(10)]
+        etalon = [{COLUMN_KEY: i, COLUMN_VAL: i + 2, "name": str(i)} for i in range(10)]
+
+        h = ComputeGraph(source="names")
+        g = ComputeGraph(source="source")
+        g.add_map(inc_val_mapper, in_place=True)
+        g.add_map(inc_val_mapper, in_place=True)
+        g.add_map(remember_mapper, in_place=True)
+        g.add_join(h, join_by=COLUMN_KEY, algorithm="hash")
+        output = list(g.run(source=input, names=names))
+        assert output == etalon
+        # the rows are copied once, before the first mapper, and joined in place
+        assert all(row is mapped_row for row, mapped_row in zip(output, mapped))
+        assert input == [{COLUMN_KEY: i, COLUMN_VAL: i} for i in range(10)]
+        assert names == [{COLUMN_KEY: i, "name": str(i)} for i in range(10)]
+
+    def test_reyielded_rows_copied(self):
+        def explode_mapper(row):
+            # the same row is changed and yielded several times
+            for name in ("A", "B", "C"):
+                row["name"] = name
+                yield row
+
+        def mark_mapper(row):
+            row[COLUMN_VAL] += 1
+            yield row
+
+        input = [{COLUMN_KEY: 0, COLUMN_VAL: 0}]
+        names = [{COLUMN_KEY: 0, "label": "zero"}]
+        etalon = [{COLUMN_KEY: 0, COLUMN_VAL: 1, "name": name} for name in ("A", "B", "C")]
+
+        g = ComputeGraph(source="source")
+        g.add_map(explode_mapper)
+        g.add_map(mark_mapper, in_place=True)
+        g.add_sort((COLUMN_KEY, "name"))
+        assert list(g.run(source=input)) == etalon
+
+        # a left row isn't reused for its last joined row after such a mapper
+        h = ComputeGraph(source="names")
+        f = ComputeGraph(source="source")
+        f.add_map(explode_mapper)
+        f.add_join(h, join_by=COLUMN_KEY, algorithm="hash")
+        f.add_map(mark_mapper, in_place=True)
+        f.add_sort((COLUMN_KEY, "name"))
+        assert list(f.run(source=input, names=names)) == [dict(row, label="zero") for row in etalon]
+
+    def test_sort_with_limit(self):
+        input = [{COLUMN_KEY: i % 10, COLUMN_VAL: i} for i in range(100)]
+
+        g = ComputeGraph(source="source")
+        g.add_sort((COLUMN_KEY, COLUMN_VAL))
+        g.add_limit(3)
+        assert "top 3 rows" in g.explain()
+        assert list(g.run(source=input)) == [{COLUMN_KEY: 0, COLUMN_VAL: i} for i in (0, 10, 20)]
+
+
 class TestStructure:
+    def test_concurrent_graphs(self):
+        barrier = threading.Barrier(2, timeout=10)
+
+        def waiting_mapper(row):
+            barrier.wait()
+            yield row
+
+        a = ComputeGraph(source="a_source")
+        a.add_map(waiting_mapper)
+        b = ComputeGraph(source="b_source")
+        b.add_map(waiting_mapper)
+        c = ComputeGraph(source=a)
+        c.add_join(b, join_by=COLUMN_KEY)
+
+        input = [{COLUMN_KEY: i} for i in range(10)]
+        output = c.run(a_source=input, b_source=input, max_workers=2)
+        assert sorted(output, key=itemgetter(COLUMN_KEY)) == input
+
     def test_diamond_structure(self):
         a = ComputeGraph(source="a_source")
         b = ComputeGraph(source="b_source")